@@ -1,4 +1,5 @@
 import streamlit as st
+from market_data import start_prefetch
 
 st.set_page_config(layout="wide")
 hide_st_style = """
@@ -10,6 +11,9 @@ hide_st_style = """
             """
 st.markdown(hide_st_style, unsafe_allow_html=True)
 
+# Start loading the default stocks in the background, so they are cached by the time the charts are opened
+start_prefetch()
+
 
 st.title("Python Case")
 st.text("Case description")
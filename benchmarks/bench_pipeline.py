@@ -0,0 +1,178 @@
+"""Benchmark of the fetch -> resample -> align -> normalize -> plot pipeline on offline data.
+
+Every configuration of N symbols x Y years x granularity runs each stage of the pipeline
+used by Steps 3 and 4 on synthetic prices from the fixture provider, plus the long-frame
+pipeline the pages used before (pd.concat, groupby normalization, per-stock masks) for
+comparison. Each stage reports its best time over --repeat runs and its peak traced memory,
+and the whole report is written as JSON so runs of different versions can be diffed.
+
+    python -m benchmarks.bench_pipeline --symbols 5 50 200 --years 20 --granularity Daily Monthly --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+# Offline, deterministic prices and no API rate limit unless set in the environment
+os.environ["CASE3_PROVIDER"] = "fixture"
+os.environ.setdefault("CASE3_FETCH_RATE", "1000")
+os.environ.setdefault("CASE3_FETCH_BURST", "1000")
+# The benchmark passes its own stores, this one is only created by market_data.fetch and removed on exit
+_store_dir = None
+if "CASE3_STORE_DIR" not in os.environ:
+    _store_dir = tempfile.TemporaryDirectory(prefix="case3-bench-")
+    os.environ["CASE3_STORE_DIR"] = _store_dir.name
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+from market_data import fetch
+from market_data.charts import price_figure
+from market_data.frame import align_columns
+from market_data.normalize import Rebaser, normalize, rebase_factors
+from market_data.providers import get_provider
+from market_data.resample import GRANULARITIES, resample_history
+from market_data.store import PriceStore
+
+
+def measure(function, repeat):
+    """Return (best seconds, peak traced bytes, result) of function()."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(timings), peak, result
+
+
+def build_figure(traces):
+    # Same trace building as draw_plot in the pages
+    fig = go.Figure()
+    for name, x, y in traces:
+        fig = fig.add_trace(go.Scatter(x=x, y=y, name=name))
+    return fig
+
+
+def run_config(symbol_count, years, granularity, repeat, column="Close"):
+    symbols = ["SYN{:04d}".format(number) for number in range(symbol_count)]
+    end = pd.Timestamp(datetime.today().date())
+    start = end - pd.Timedelta(days=years * 365)
+    provider = get_provider()
+    stages = {}
+
+    def stage(name, function, times=repeat):
+        seconds, peak, result = measure(function, times)
+        stages[name] = {"seconds": seconds, "peak_bytes": peak}
+        return result
+
+    # Download into an empty store (a new one for the timed and the traced run), then read back the covered
+    # window from memory. The stores of a configuration are removed once it is measured
+    with tempfile.TemporaryDirectory(prefix="case3-bench-") as store_dir:
+        history, _ = stage("fetch_cold", lambda: fetch.top_up(
+            symbols, start, end, store=PriceStore(tempfile.mkdtemp(dir=store_dir)),
+            download=provider.download, timeout=None), times=1)
+    daily = stage("fetch_warm", lambda: {symbol: fetch.slice_history(history[symbol], start, end) for symbol in symbols})
+    resampled = stage("resample", lambda: {symbol: resample_history(frame, granularity) for symbol, frame in daily.items()})
+    series = {symbol: frame[column] for symbol, frame in resampled.items()}
+
+    # Current pipeline: one aligned Date x Symbol frame
+    matrix = stage("align", lambda: align_columns(series))
+    stage("rebase_precompute", lambda: Rebaser(matrix))
+    stage("rebase_factors", lambda: rebase_factors(matrix, start + (end - start) / 2))
+    normalized = stage("normalize", lambda: normalize(matrix))
+    selected = stage("select", lambda: normalized[symbols])
+    fig = stage("figure", lambda: build_figure((symbol, selected.index, selected[symbol]) for symbol in symbols))
+    payload = stage("serialize", lambda: fig.to_json())
+    downsampled = stage("figure_downsampled", lambda: price_figure(selected))
+    downsampled_payload = stage("serialize_downsampled", lambda: downsampled.to_json())
+
+    # Previous pipeline: long frame grown with pd.concat and filtered per stock
+    def legacy_concat():
+        df = pd.DataFrame()
+        for symbol, values in series.items():
+            frame = values.reset_index()
+            frame["Symbol"] = symbol
+            df = pd.concat([df, frame])
+        return df
+
+    long_df = stage("legacy_concat", legacy_concat)
+
+    def legacy_normalize():
+        df = long_df.copy()
+        df[column] = df[column] / df.groupby("Symbol")[column].transform("first") * 100
+        return df
+
+    long_df = stage("legacy_normalize", legacy_normalize)
+    dfs = stage("legacy_mask_filter", lambda: {symbol: long_df[long_df["Symbol"] == symbol] for symbol in symbols})
+    stage("legacy_figure", lambda: build_figure((symbol, df["Date"], df[column]) for symbol, df in dfs.items()))
+
+    return {
+        "symbols": symbol_count,
+        "years": years,
+        "granularity": granularity,
+        "rows": int(matrix.shape[0]),
+        "points": int(matrix.notna().to_numpy().sum()),
+        "payload_bytes": len(payload),
+        "downsampled_payload_bytes": len(downsampled_payload),
+        "stages": stages,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--symbols", type=int, nargs="+", default=[5, 50, 200])
+    parser.add_argument("--years", type=int, nargs="+", default=[20])
+    parser.add_argument("--granularity", nargs="+", default=["Daily", "Monthly"], choices=list(GRANULARITIES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    results = []
+    for symbol_count in args.symbols:
+        for years in args.years:
+            for granularity in args.granularity:
+                result = run_config(symbol_count, years, granularity, args.repeat)
+                results.append(result)
+                print("{symbols} symbols x {years} years, {granularity}: {rows} rows".format(**result), file=sys.stderr)
+                for name, stage in result["stages"].items():
+                    print("  {:<20} {:>10.4f}s {:>10.1f} MiB".format(name, stage["seconds"], stage["peak_bytes"] / 2 ** 20),
+                          file=sys.stderr)
+
+    report = {
+        "revision": git_revision(),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+"""Shared stock price helpers used by the Streamlit pages."""
+
+from market_data.analytics import BENCHMARK, performance_table
+from market_data.charts import compact_figure, price_chart, price_figure
+from market_data.fetch import fetch_prices, fetch_stats
+from market_data.frame import price_matrix
+from market_data.instrument import finish_rerun, process_percentiles, stage, start_rerun
+from market_data.lru import cache_usage
+from market_data.prefetch import prefetch_status, start_prefetch
+from market_data.resample import GRANULARITIES, resample_prices
+from market_data.rolling import ROLLING_METRICS, ROLLING_WINDOWS, rolling_matrix
+from market_data.symbols import search_symbols, symbol_index
+from market_data.universe import universe_symbols
+from market_data.validate import normalize_ticker, validate_ticker
@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+
+from market_data.fetch import history_version
+from market_data.frame import price_matrix
+from market_data.instrument import timed
+from market_data.lru import LRUCache
+from market_data.normalize import forward_fill
+
+# The index the stocks are compared against
+BENCHMARK = "^GSPC"
+TRADING_DAYS = 252
+
+METRICS = ["Total return", "CAGR", "Volatility", "Max drawdown", "Sharpe", "Beta", "Correlation"]
+
+# Performance tables per (symbols, history versions, start, end, column, benchmark, risk free rate)
+_memo = LRUCache(max_entries=64, name="performance tables")
+
+
+def performance_metrics(matrix, benchmark=BENCHMARK, risk_free=0.0):
+    """Compute METRICS for every column of a daily Date x Symbol price matrix.
+
+    All symbols are computed at once with array operations. Prices are forward filled,
+    so days a stock didn't trade (other calendars) count as unchanged, and every metric
+    only uses the days since the stock's first price. Volatility, Sharpe (with the
+    annual risk_free rate) and CAGR are annualized; beta and correlation are against the
+    daily returns of the benchmark column, over the days both have returns.
+    """
+    values = forward_fill(matrix.to_numpy(dtype="float64"))
+    symbols = matrix.columns
+    if len(values) < 2:
+        return pd.DataFrame(np.nan, index=symbols, columns=METRICS)
+
+    valid = ~np.isnan(values)
+    first = values[valid.argmax(axis=0), np.arange(values.shape[1])]
+    last = values[-1]
+    total_return = last / first - 1
+    days = (matrix.index[-1] - matrix.index[valid.argmax(axis=0)]).days.to_numpy()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cagr = np.where(days > 0, (1 + total_return) ** (365.25 / days) - 1, np.nan)
+
+        returns = values[1:] / values[:-1] - 1
+        has_return = ~np.isnan(returns)
+        count = has_return.sum(axis=0)
+        mean = np.where(has_return, returns, 0).sum(axis=0) / count
+        deviation = np.where(has_return, returns - mean, 0)
+        variance = (deviation ** 2).sum(axis=0) / (count - 1)
+        volatility = np.sqrt(variance * TRADING_DAYS)
+        sharpe = (mean * TRADING_DAYS - risk_free) / volatility
+
+        drawdown = values / np.fmax.accumulate(values, axis=0) - 1
+        max_drawdown = np.nanmin(np.where(valid, drawdown, np.nan), axis=0)
+
+        beta = np.full(len(symbols), np.nan)
+        correlation = np.full(len(symbols), np.nan)
+        if benchmark in symbols:
+            market = returns[:, [symbols.get_loc(benchmark)]]
+            both = has_return & ~np.isnan(market)
+            pairs = both.sum(axis=0)
+            stock_part = np.where(both, returns, 0)
+            market_part = np.where(both, market, 0)
+            stock_deviation = np.where(both, returns - stock_part.sum(axis=0) / pairs, 0)
+            market_deviation = np.where(both, market - market_part.sum(axis=0) / pairs, 0)
+            covariance = (stock_deviation * market_deviation).sum(axis=0)
+            market_variance = (market_deviation ** 2).sum(axis=0)
+            beta = covariance / market_variance
+            correlation = covariance / np.sqrt((stock_deviation ** 2).sum(axis=0) * market_variance)
+
+    return pd.DataFrame({
+        "Total return": total_return,
+        "CAGR": cagr,
+        "Volatility": volatility,
+        "Max drawdown": max_drawdown,
+        "Sharpe": sharpe,
+        "Beta": beta,
+        "Correlation": correlation,
+    }, index=symbols)
+
+
+@timed("performance_table", rows=len)
+def performance_table(symbols, start_date, end_date, column="Adj Close", benchmark=BENCHMARK, risk_free=0.0):
+    """Return METRICS of the symbols over the [start_date, end_date) range, one row per symbol.
+
+    The benchmark is loaded along with the symbols, but only has a row if it is one of
+    them. Tables are memoized until the price history of one of the symbols changes.
+    """
+    symbols = list(dict.fromkeys(symbols))
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    loaded = list(dict.fromkeys(symbols + [benchmark]))
+    matrix = price_matrix(loaded, start, end, "Daily", column)
+    key = (tuple(symbols), tuple(history_version(symbol) for symbol in loaded), start, end, column, benchmark, risk_free)
+    table = _memo.get(key)
+    if table is None:
+        table = performance_metrics(matrix, benchmark, risk_free).loc[symbols]
+        _memo.put(key, table)
+    return table
@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+from market_data import config
+from market_data.fetch import history_version
+from market_data.frame import price_matrix
+from market_data.instrument import timed
+from market_data.lru import LRUCache
+from market_data.normalize import rebase_factors
+
+# Downsampled (x, y) of a stock's line per (symbol, history version, view) and whole
+# figures per (stocks, history versions, view), see price_chart
+_lines = LRUCache(max_entries=config.CHART_CACHE_LINES, name="chart lines")
+_figures = LRUCache(max_entries=config.CHART_CACHE_FIGURES, name="chart figures")
+
+
+def lttb(x, y, threshold):
+    """Return the indices of the points kept by Largest-Triangle-Three-Buckets downsampling.
+
+    The first and last points are always kept. The points in between are split into
+    threshold - 2 buckets and from each bucket the point forming the largest triangle
+    with the previously kept point and the average of the next bucket is kept, which
+    preserves peaks and troughs far better than taking every n-th point.
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+    # Bucket averages don't depend on the kept points, so they are computed in one go.
+    # The last bucket is followed by the last point alone.
+    counts = np.diff(np.append(edges, n))
+    mean_x = np.add.reduceat(x, edges) / counts
+    mean_y = np.add.reduceat(y, edges) / counts
+    kept = 0
+    for bucket in range(threshold - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        next_x = mean_x[bucket + 1]
+        next_y = mean_y[bucket + 1]
+        area = np.abs((x[kept] - next_x) * (y[start:stop] - y[kept])
+                      - (x[kept] - x[start:stop]) * (next_y - y[kept]))
+        kept = start + int(np.argmax(area))
+        indices[bucket + 1] = kept
+    return indices
+
+
+def downsample(series, max_points):
+    """Return (x, y) of a date indexed series reduced to at most max_points with LTTB."""
+    series = series.dropna()
+    x = series.index.to_numpy()
+    y = series.to_numpy(dtype="float64")
+    indices = lttb(x.astype("datetime64[ns]").astype(np.int64), y, max_points)
+    return x[indices], y[indices]
+
+
+def price_figure(df, max_points=config.CHART_MAX_POINTS, webgl_threshold=config.CHART_WEBGL_THRESHOLD):
+    """Build the line chart of a Date x Stock frame with one line per column.
+
+    Every line is downsampled to max_points, so the browser gets about one point per
+    pixel however long the history is; a narrower date window keeps more detail. Once
+    the chart still has more than webgl_threshold points, lines are drawn with WebGL.
+    """
+    return line_figure([(stock, *downsample(df[stock], max_points)) for stock in df.columns], webgl_threshold)
+
+
+def line_figure(lines, webgl_threshold=config.CHART_WEBGL_THRESHOLD):
+    """Build a figure from (name, x, y) lines, drawn with WebGL above webgl_threshold points."""
+    scatter = go.Scattergl if sum(len(y) for _, _, y in lines) > webgl_threshold else go.Scatter
+    fig = go.Figure()
+    for name, x, y in lines:
+        fig = fig.add_trace(scatter(x=x, y=y, name=name, mode="lines"))
+    return compact_figure(fig)
+
+
+def compact_figure(fig):
+    """Make the traces of fig serialize as binary arrays instead of JSON lists, in place.
+
+    Plotly sends numpy arrays as base64 encoded typed arrays, but dates as ISO strings
+    of 20+ characters each. Dates are therefore sent as float64 milliseconds since the
+    epoch, which date axes show as dates, and values as float32, about a third of the
+    JSON size of a long line.
+    """
+    dates = False
+    for trace in fig.data:
+        x = np.asarray(trace.x) if trace.x is not None else None
+        if x is not None and x.dtype.kind == "M":
+            trace.x = x.astype("datetime64[ms]").astype(np.int64).astype("float64")
+            dates = True
+        y = np.asarray(trace.y) if trace.y is not None else None
+        if y is not None and y.dtype.kind == "f":
+            trace.y = y.astype("float32")
+    if dates:
+        fig.update_xaxes(type="date")
+    return fig
+
+
+@timed("price_chart", rows=lambda fig: sum(len(trace.y) for trace in fig.data))
+def price_chart(stocks, start_date, end_date, granularity, column="Close", normalize=False, window=None,
+                rebase_date=None, max_points=config.CHART_MAX_POINTS, webgl_threshold=config.CHART_WEBGL_THRESHOLD):
+    """Return the chart of the {name: symbol} stocks for the [start_date, end_date) range.
+
+    normalize rebases every line to 100 at rebase_date (the first price in the range by
+    default) and window is an optional (start, end) part of the range to show, see
+    price_figure for downsampling. Figures are memoized on the stocks, range, granularity,
+    normalization, window and the version of the price history, so a rerun that changes
+    none of them reuses the figure. The downsampled prices are memoized per stock and
+    rebasing only scales them, so a new selection builds the lines of newly selected
+    stocks only and a new rebase date builds none. The figure is shared between callers,
+    so treat it as read-only.
+    """
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    window = (pd.Timestamp(window[0]), pd.Timestamp(window[1])) if window else (start, end)
+    rebase_date = pd.Timestamp(rebase_date) if normalize and rebase_date is not None else None
+    matrix = price_matrix(stocks.values(), start, end, granularity, column)
+    view = (start, end, granularity, column, window, max_points)
+    versions = tuple(history_version(symbol) for symbol in stocks.values())
+    key = (tuple(stocks.items()), versions, view, normalize, rebase_date, webgl_threshold)
+    fig = _figures.get(key)
+    if fig is None:
+        # Rebasing is a positive scale, which doesn't change the points LTTB keeps
+        factors = rebase_factors(matrix, rebase_date) if normalize else None
+        lines = []
+        for (name, symbol), version in zip(stocks.items(), versions):
+            line = _lines.get((symbol, version, view))
+            if line is None:
+                x, y = downsample(matrix[symbol].loc[window[0]:window[1]], max_points)
+                # Screen coordinates don't need more than float32
+                line = (x, y.astype("float32"))
+                _lines.put((symbol, version, view), line)
+            x, y = line
+            lines.append((name, x, y * factors[symbol] if normalize else y))
+        fig = line_figure(lines, webgl_threshold)
+        _figures.put(key, fig)
+    return fig
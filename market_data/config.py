@@ -0,0 +1,56 @@
+import os
+
+# Where prices come from: "yfinance" or "fixture" for offline runs (see market_data.providers)
+PROVIDER = os.environ.get("CASE3_PROVIDER", "yfinance")
+# Parquet fixtures for the fixture provider, synthetic prices are generated if not set
+FIXTURE_DIR = os.environ.get("CASE3_FIXTURE_DIR")
+# Simulated latency per call (seconds) and share of failing calls of the fixture provider
+FIXTURE_DELAY = float(os.environ.get("CASE3_FIXTURE_DELAY", "0"))
+FIXTURE_ERROR_RATE = float(os.environ.get("CASE3_FIXTURE_ERROR_RATE", "0"))
+
+# Symbol master (CSV with Symbol and Name columns) searched when adding stocks, see market_data.symbols
+SYMBOLS_FILE = os.environ.get("CASE3_SYMBOLS_FILE", os.path.join(os.path.dirname(__file__), "symbols.csv"))
+
+# Directory of the on-disk price store, one Arrow file per symbol and a separate store per provider.
+# Several server processes can share it, e.g. on a shared volume
+STORE_DIR = os.environ.get("CASE3_STORE_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), ".price_store", PROVIDER))
+# Directory of the prebuilt universe of daily adjusted closes (see market_data.universe), not used until it is built
+UNIVERSE_DIR = os.environ.get("CASE3_UNIVERSE_DIR", os.path.join(STORE_DIR, "universe"))
+
+# Fetch engine: parallel downloads, API rate limit (requests per second and burst size),
+# retries with exponential backoff and how long a page waits for downloads before
+# rendering with what it has
+FETCH_WORKERS = int(os.environ.get("CASE3_FETCH_WORKERS", "4"))
+FETCH_RATE = float(os.environ.get("CASE3_FETCH_RATE", "2"))
+FETCH_BURST = int(os.environ.get("CASE3_FETCH_BURST", "4"))
+FETCH_RETRIES = int(os.environ.get("CASE3_FETCH_RETRIES", "3"))
+FETCH_BACKOFF = float(os.environ.get("CASE3_FETCH_BACKOFF", "0.5"))
+FETCH_TIMEOUT = float(os.environ.get("CASE3_FETCH_TIMEOUT", "30"))
+# Parallel downloads of the background prefetch and universe update, on top of FETCH_WORKERS and within the same rate limit
+BACKGROUND_FETCH_WORKERS = int(os.environ.get("CASE3_BACKGROUND_FETCH_WORKERS", "1"))
+# Symbols per provider download call
+FETCH_CHUNK_SIZE = int(os.environ.get("CASE3_FETCH_CHUNK_SIZE", "25"))
+
+# Memory all named in-process caches (price history, resampled frames, matrices, chart lines...) may
+# hold together, least recently used entries are dropped beyond it
+CACHE_MEMORY_MB = float(os.environ.get("CASE3_CACHE_MEMORY_MB", "1024"))
+
+# Record stage timings, cache lookups and payload sizes of every page run and log them (see
+# market_data.instrument), pages can also turn it on per session
+INSTRUMENT = os.environ.get("CASE3_INSTRUMENT", "0") == "1"
+
+# Charts: points kept per line after downsampling (about the pixel width of a wide chart)
+# and the number of points from which lines are drawn with WebGL instead of SVG
+CHART_MAX_POINTS = int(os.environ.get("CASE3_CHART_MAX_POINTS", "1500"))
+CHART_WEBGL_THRESHOLD = int(os.environ.get("CASE3_CHART_WEBGL_THRESHOLD", "5000"))
+# Memoized chart lines and whole figures kept per process
+CHART_CACHE_LINES = int(os.environ.get("CASE3_CHART_CACHE_LINES", "512"))
+CHART_CACHE_FIGURES = int(os.environ.get("CASE3_CHART_CACHE_FIGURES", "64"))
+
+# Background prefetch: symbols loaded at server start and refreshed every business day at
+# PREFETCH_REFRESH_AT (HH:MM, market time) after the close, and how many days back they are loaded.
+# Today's bar only counts as downloaded from PREFETCH_REFRESH_AT on. An empty symbol list turns the prefetch off
+PREFETCH_SYMBOLS = [symbol for symbol in os.environ.get("CASE3_PREFETCH_SYMBOLS", "AAPL,GOOGL,TSLA,MSFT,^GSPC").split(",") if symbol]
+PREFETCH_DAYS = int(os.environ.get("CASE3_PREFETCH_DAYS", str(20 * 365)))
+PREFETCH_REFRESH_AT = os.environ.get("CASE3_PREFETCH_REFRESH_AT", "16:30")
+PREFETCH_TIMEZONE = os.environ.get("CASE3_PREFETCH_TIMEZONE", "America/New_York")
@@ -0,0 +1,134 @@
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import pandas as pd
+
+from market_data import config
+
+logger = logging.getLogger(__name__)
+
+
+class TransientFetchError(Exception):
+    """Raised by download functions for failures worth retrying, e.g. throttling."""
+
+
+def is_transient(error):
+    # Network errors (requests and socket errors are OSErrors) are retried as well
+    return isinstance(error, (TransientFetchError, OSError))
+
+
+class TokenBucket:
+    """Allows rate calls per second on average with bursts of up to capacity calls."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+
+class FetchStats:
+    """Per-symbol download counts, failures, latency and requests coalesced into running downloads."""
+
+    def __init__(self):
+        self._symbols = defaultdict(lambda: {"requests": 0, "failures": 0, "coalesced": 0, "total_latency": 0.0,
+                                             "last_latency": 0.0})
+        self._lock = threading.Lock()
+
+    def record(self, symbols, latency, failed):
+        with self._lock:
+            for symbol in symbols:
+                stats = self._symbols[symbol]
+                stats["requests"] += 1
+                stats["failures"] += failed
+                stats["total_latency"] += latency
+                stats["last_latency"] = latency
+
+    def record_coalesced(self, symbols):
+        """Count requests for symbols that waited for a download already running instead of starting one."""
+        with self._lock:
+            for symbol in symbols:
+                self._symbols[symbol]["coalesced"] += 1
+
+    def snapshot(self):
+        """Return the statistics as a frame with one row per symbol."""
+        with self._lock:
+            rows = [dict(stats, symbol=symbol) for symbol, stats in self._symbols.items()]
+        df = pd.DataFrame(rows, columns=["symbol", "requests", "failures", "coalesced", "total_latency",
+                                         "last_latency"])
+        df["mean_latency"] = df["total_latency"] / df["requests"]
+        return df.set_index("symbol").drop(columns="total_latency")
+
+
+class FetchEngine:
+    """Runs downloads in parallel on a bounded thread pool.
+
+    Every download call waits for the rate limiter and is retried with exponential
+    backoff and jitter on transient errors. The download function is passed in, so the
+    engine runs the same against yfinance or a local fake that injects delays and errors.
+
+    Engines given the limiter and stats of another one share its rate limit and
+    statistics but run on a pool of their own.
+    """
+
+    def __init__(self, max_workers=config.FETCH_WORKERS, rate=config.FETCH_RATE, burst=config.FETCH_BURST,
+                 retries=config.FETCH_RETRIES, backoff=config.FETCH_BACKOFF, limiter=None, stats=None):
+        self.retries = retries
+        self.backoff = backoff
+        self.limiter = limiter if limiter is not None else TokenBucket(rate, burst)
+        self.stats = stats if stats is not None else FetchStats()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fetch")
+
+    def call(self, download, symbols, start, end):
+        """Run download(symbols, start, end) with rate limiting and retries."""
+        for attempt in range(self.retries + 1):
+            self.limiter.acquire()
+            started = time.perf_counter()
+            try:
+                result = download(symbols, start, end)
+            except Exception as error:
+                self.stats.record(symbols, time.perf_counter() - started, failed=True)
+                if attempt == self.retries or not is_transient(error):
+                    raise
+                delay = self.backoff * 2 ** attempt * (1 + random.random())
+                logger.warning("Download of %s failed (%s), retrying in %.1fs", ", ".join(symbols), error, delay)
+                time.sleep(delay)
+            else:
+                self.stats.record(symbols, time.perf_counter() - started, failed=False)
+                return result
+
+    def map(self, function, items, timeout=None):
+        """Run function(item) for all items on the pool.
+
+        Returns (results, errors, pending): {item: result} and {item: exception} for the
+        items that finished within timeout seconds, and the items still running. Those
+        keep running in the background, so whatever they store is there for the next call.
+        """
+        futures = {self._pool.submit(function, item): item for item in items}
+        done, not_done = wait(futures, timeout=timeout)
+        results = {}
+        errors = {}
+        for future in done:
+            error = future.exception()
+            if error is None:
+                results[futures[future]] = future.result()
+            else:
+                errors[futures[future]] = error
+        return results, errors, [futures[future] for future in not_done]
@@ -0,0 +1,114 @@
+"""Export resampled and normalized prices of a large ticker universe without Streamlit.
+
+Symbols are processed in batches of --batch-size. Every batch is topped up in parallel
+through the on-disk price store and the fetch engine, resampled and rebased to 100 at
+the first date like the final page, and written as one part file of long rows (Date,
+Symbol, price column, Normalized). Nothing is kept in memory between batches, so memory
+stays bounded by the batch size whatever the size of the universe. The output directory
+reads back as one dataset, e.g. pd.read_parquet(output).
+
+    python -m market_data.export --tickers-file sp500.txt --granularity Quarterly --output exports/sp500
+"""
+import argparse
+import logging
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from market_data.fetch import slice_history, top_up
+from market_data.frame import align_columns
+from market_data.normalize import Rebaser
+from market_data.resample import GRANULARITIES, resample_history
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ["parquet", "csv"]
+
+
+def read_tickers(path):
+    """Return the tickers of a file with one ticker per line, or a CSV file with a Symbol column."""
+    if path.endswith(".csv"):
+        return pd.read_csv(path)["Symbol"].dropna().astype(str).tolist()
+    with open(path) as file:
+        return [line.strip() for line in file if line.strip() and not line.startswith("#")]
+
+
+def export_batch(symbols, start, end, granularity, column, timeout=None):
+    """Return the long frame of one batch of symbols and the symbols without data.
+
+    The batch waits for its downloads (up to timeout seconds if given), so slow ones
+    aren't exported as missing while they keep running next to the next batch.
+    """
+    history, _ = top_up(symbols, start, end, timeout=timeout)
+    series = {}
+    for symbol in symbols:
+        frame = slice_history(history[symbol], start, end) if symbol in history else None
+        if frame is not None and not frame.empty:
+            series[symbol] = resample_history(frame, granularity)[column]
+    missing = [symbol for symbol in symbols if symbol not in series]
+    prices = align_columns(series)
+    # The same rebasing as the pages, not memoized since every matrix is used once
+    normalized = prices * Rebaser(prices).factors()
+    rows = pd.DataFrame({
+        column: prices.stack(),
+        "Normalized": normalized.stack(),
+    }).reset_index()
+    # Dates on which only some of the symbols traded
+    return rows.dropna(subset=[column]), missing
+
+
+def write_part(rows, output, number, output_format):
+    path = os.path.join(output, "part-{:05d}.{}".format(number, output_format))
+    if output_format == "parquet":
+        rows.to_parquet(path, index=False)
+    else:
+        rows.to_csv(path, index=False)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("tickers", nargs="*", help="Tickers to export, added to those of --tickers-file")
+    parser.add_argument("--tickers-file", help="File with one ticker per line, or a CSV file with a Symbol column")
+    parser.add_argument("--start", default=str(datetime.today().date() - timedelta(days=20 * 365)))
+    parser.add_argument("--end", default=str(datetime.today().date()))
+    parser.add_argument("--granularity", default="Quarterly", choices=list(GRANULARITIES))
+    parser.add_argument("--column", default="Adj Close")
+    parser.add_argument("--format", default="parquet", choices=FORMATS)
+    parser.add_argument("--batch-size", type=int, default=100, help="Symbols fetched and held in memory at a time")
+    parser.add_argument("--output", required=True, help="Directory for the part files")
+    parser.add_argument("--timeout", type=float, help="Seconds a batch waits for its downloads, no limit by default")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    tickers = list(args.tickers)
+    if args.tickers_file:
+        tickers += read_tickers(args.tickers_file)
+    tickers = list(dict.fromkeys(ticker.strip().upper() for ticker in tickers))
+    if not tickers:
+        parser.error("no tickers given")
+
+    os.makedirs(args.output, exist_ok=True)
+    # Parts of an earlier run with more batches would otherwise be read as part of this one
+    for name in os.listdir(args.output):
+        if name.startswith("part-") and name.endswith(tuple("." + output_format for output_format in FORMATS)):
+            os.remove(os.path.join(args.output, name))
+    start, end = pd.Timestamp(args.start), pd.Timestamp(args.end)
+    missing = []
+    for number, position in enumerate(range(0, len(tickers), args.batch_size)):
+        batch = tickers[position:position + args.batch_size]
+        rows, batch_missing = export_batch(batch, start, end, args.granularity, args.column, args.timeout)
+        missing += batch_missing
+        path = write_part(rows, args.output, number, args.format)
+        logger.info("Wrote %s rows of %s symbols to %s", len(rows), len(batch) - len(batch_missing), path)
+
+    if missing:
+        logger.warning("No data for %s of %s tickers: %s", len(missing), len(tickers), ", ".join(missing))
+    # A nightly job should notice when nothing could be exported at all
+    return 1 if len(missing) == len(tickers) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
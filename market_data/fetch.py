@@ -0,0 +1,333 @@
+import logging
+import threading
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+from market_data import config
+from market_data.engine import FetchEngine
+from market_data.instrument import timed
+from market_data.lru import LRUCache
+from market_data.providers import empty_history, get_provider
+from market_data.store import PriceStore
+
+logger = logging.getLogger(__name__)
+
+# Relative difference from which a re-downloaded bar counts as revised (by a split or a dividend)
+REVISION_TOLERANCE = 1e-4
+REVISION_COLUMNS = ["Close", "Adj Close"]
+
+# Widest daily history held per symbol as (frame, (start, end)), shared by every session of the server process.
+# Evicted symbols are read back from the store when they are needed again
+_cache = LRUCache(max_entries=None, name="price history")
+# Bumped whenever a symbol's cached history changes, lets derived data be memoized per version
+_versions = defaultdict(int)
+# Range covered by the history each version stands for. The stored history only changes when its range grows,
+# so a history read back from the store (after an eviction) for the same range keeps its version
+_versioned_coverage = {}
+# Ranges the provider answered without any data for, as symbol -> (start, end), see confirmed_empty
+_empty = LRUCache(max_entries=1024)
+_lock = threading.Lock()
+# Top-ups running in this process as symbol -> (start, end, event set once the cache is updated)
+_in_flight = {}
+_store = PriceStore()
+_engine = FetchEngine()
+# Background refreshes run on their own workers, so page requests never queue behind hundreds of their downloads
+_background_engine = FetchEngine(max_workers=config.BACKGROUND_FETCH_WORKERS, limiter=_engine.limiter,
+                                 stats=_engine.stats)
+_provider = get_provider()
+
+
+def missing_ranges(coverage, start, end):
+    """Return the [start, end) pieces of the requested range that lie outside coverage.
+
+    Only the head before and the tail after the covered range are returned, so the
+    covered range stays contiguous once they are fetched.
+    """
+    if coverage is None:
+        return [(start, end)]
+    covered_start, covered_end = coverage
+    ranges = []
+    if start < covered_start:
+        ranges.append((start, covered_start))
+    if end > covered_end:
+        ranges.append((covered_end, end))
+    return ranges
+
+
+def merge_history(old, new):
+    if new is None or new.empty:
+        return old
+    if old.empty:
+        return new
+    merged = pd.concat([old, new])
+    # Re-fetched days (e.g. the last, possibly unfinished session) take the newer values
+    return merged[~merged.index.duplicated(keep="last")].sort_index()
+
+
+def covers(coverage, start, end):
+    return coverage is not None and coverage[0] <= start and end <= coverage[1]
+
+
+def settled_end(now=None):
+    """Return the exclusive end of the days whose daily bars are final at now.
+
+    Today's bar counts once the market is closed, from PREFETCH_REFRESH_AT in
+    PREFETCH_TIMEZONE on, before that it may be an unfinished session.
+    """
+    now = now if now is not None else pd.Timestamp.now(tz=config.PREFETCH_TIMEZONE)
+    hour, minute = map(int, config.PREFETCH_REFRESH_AT.split(":"))
+    today = pd.Timestamp(now.date())
+    return today + pd.Timedelta(days=1) if (now.hour, now.minute) >= (hour, minute) else today
+
+
+def covered_end(start, end):
+    """Return the end of the part of [start, end) that can be covered, the days whose bar is final.
+
+    Later days are downloaded with the range but asked for again once settled, so a range
+    ending in the future counts as covered up to here.
+    """
+    return max(start, min(end, settled_end()))
+
+
+def slice_history(frame, start, end):
+    # The index is sorted, so the window is a positional slice found by binary search
+    return frame.iloc[frame.index.searchsorted(start):frame.index.searchsorted(end)]
+
+
+def overlap_range(history, range_start, range_end):
+    """Return [range_start, range_end) widened to the nearest stored bar on the side of each history it extends.
+
+    The stored bars downloaded again tell whether the source has revised the history since.
+    """
+    starts = [frame.index[-1] for frame in history if not frame.empty and frame.index[-1] < range_start]
+    ends = [frame.index[0] + pd.Timedelta(days=1) for frame in history if not frame.empty and frame.index[0] >= range_end]
+    return min(starts, default=range_start), max(ends, default=range_end)
+
+
+def revised(old, new, coverage):
+    """Return whether bars of new within coverage differ from the same bars of old.
+
+    Splits rescale the Close and dividends the Adj Close of every earlier bar, so a
+    stored history that no longer matches the source has to be downloaded again.
+    """
+    old = slice_history(old, *coverage)
+    dates = old.index.intersection(new.index)
+    if dates.empty:
+        return False
+    return not np.allclose(old.loc[dates, REVISION_COLUMNS].to_numpy(dtype="float64"),
+                           new.loc[dates, REVISION_COLUMNS].to_numpy(dtype="float64"),
+                           rtol=REVISION_TOLERANCE, equal_nan=True)
+
+
+def top_up_chunk(symbols, ranges, store=_store, download=_provider.download, engine=_engine):
+    """Download the missing ranges of symbols, merge them into the stored history and save it.
+
+    Returns {symbol: (frame, (start, end))} with the full history and the range it covers.
+
+    The symbols are locked in the store while this runs, so of several server processes
+    sharing a store only one downloads a symbol at a time. Its history is read once the
+    lock is held, and symbols another process has topped up in the meantime are not
+    downloaded again.
+    """
+    with store.lock(symbols):
+        history = {}
+        coverage = {}
+        for symbol in symbols:
+            history[symbol], coverage[symbol] = store.load(symbol) or (empty_history(), None)
+        outdated = [symbol for symbol in symbols
+                    if not all(covers(coverage[symbol], range_start, covered_end(range_start, range_end))
+                               for range_start, range_end in ranges)]
+        stored = {symbol: (history[symbol], coverage[symbol]) for symbol in outdated}
+        revisions = []
+        for range_start, range_end in ranges if outdated else []:
+            # One stored bar next to the range is downloaded again, to notice splits and dividends
+            fetch_start, fetch_end = overlap_range([history[symbol] for symbol in outdated], range_start, range_end)
+            fetched = engine.call(download, outdated, fetch_start, fetch_end)
+            # Days whose bar may still change are not covered, so they are downloaded again once settled
+            range_covered_end = covered_end(range_start, range_end)
+            for symbol in outdated:
+                # Only days the provider answered for count as covered, the others are asked for again next time
+                if symbol not in fetched:
+                    continue
+                if coverage[symbol] is not None and revised(history[symbol], fetched[symbol], coverage[symbol]):
+                    revisions.append(symbol)
+                history[symbol] = merge_history(history[symbol], fetched[symbol])
+                if coverage[symbol] is None:
+                    coverage[symbol] = (range_start, range_covered_end)
+                else:
+                    coverage[symbol] = (min(coverage[symbol][0], range_start),
+                                        max(coverage[symbol][1], range_covered_end))
+        revisions = list(dict.fromkeys(revisions))
+        if revisions:
+            # Stored bars mixing the old and the new adjustment would show a jump, the whole range is replaced
+            logger.info("Price history of %s was revised, downloading it again", ", ".join(revisions))
+            fetch_start = min(coverage[symbol][0] for symbol in revisions)
+            fetch_end = max(coverage[symbol][1] for symbol in revisions)
+            fetched = engine.call(download, revisions, fetch_start, fetch_end)
+            for symbol in revisions:
+                if symbol in fetched:
+                    history[symbol], coverage[symbol] = fetched[symbol], (fetch_start, fetch_end)
+                else:
+                    # Kept as stored, the next top-up notices the revision again
+                    history[symbol], coverage[symbol] = stored[symbol]
+                    outdated.remove(symbol)
+        for symbol in outdated:
+            # Tickers that never returned any data are not worth a file, and an unchanged file isn't rewritten
+            if history[symbol].empty or (coverage[symbol] == stored[symbol][1] and history[symbol].equals(stored[symbol][0])):
+                continue
+            store.save(symbol, history[symbol], coverage[symbol])
+    return {symbol: (history[symbol], coverage[symbol]) for symbol in symbols}
+
+
+@timed("download", rows=lambda result: sum(len(frame) for frame in result[0].values()))
+def top_up(symbols, start, end, store=_store, download=_provider.download, timeout=config.FETCH_TIMEOUT,
+           background=False):
+    """Extend the stored history of symbols to cover [start, end).
+
+    Returns ({symbol: frame}, {symbol: (start, end)}) with the full stored history and
+    the range it covers.
+
+    Only the missing head or tail of each symbol is downloaded. Symbols that miss the
+    same ranges are fetched together in chunks of FETCH_CHUNK_SIZE, so the daily refresh
+    of the whole universe is a few requests for a few rows per symbol. The chunks run in
+    parallel on the fetch engine; symbols whose download failed or did not finish within
+    timeout seconds are left out of the result, so one slow ticker doesn't hold up the
+    others. Downloads still running are saved to the store when they finish. Symbols
+    being downloaded by another process sharing the store are waited for, not fetched
+    twice. Background top-ups run on BACKGROUND_FETCH_WORKERS workers of their own, next
+    to those of the pages.
+    """
+    stored = {}
+    groups = defaultdict(list)
+    for symbol in symbols:
+        stored[symbol] = store.load(symbol) or (empty_history(), None)
+        # Days after the settled ones are downloaded with a missing range, but don't make one
+        if not covers(stored[symbol][1], start, covered_end(start, end)):
+            groups[tuple(missing_ranges(stored[symbol][1], start, end))].append(symbol)
+        else:
+            groups[()].append(symbol)
+
+    history = {}
+    coverage = {}
+    chunks = []
+    for ranges, group in groups.items():
+        if not ranges:
+            for symbol in group:
+                history[symbol], coverage[symbol] = stored[symbol]
+            continue
+        for position in range(0, len(group), config.FETCH_CHUNK_SIZE):
+            chunks.append((tuple(group[position:position + config.FETCH_CHUNK_SIZE]), ranges))
+
+    engine = _background_engine if background else _engine
+    results, errors, pending = engine.map(
+        lambda chunk: top_up_chunk(chunk[0], chunk[1], store, download, engine), chunks, timeout)
+    for result in results.values():
+        for symbol, (frame, covered) in result.items():
+            history[symbol], coverage[symbol] = frame, covered
+    for (chunk_symbols, _), error in errors.items():
+        logger.error("Failed to download %s: %s", ", ".join(chunk_symbols), error)
+    for chunk_symbols, _ in pending:
+        logger.warning("Download of %s is taking longer than %ss", ", ".join(chunk_symbols), timeout)
+    return history, coverage
+
+
+@timed("fetch_prices", rows=lambda result: sum(len(frame) for frame in result.values()))
+def fetch_prices(symbols, start_date, end_date, background=False):
+    """Return {symbol: daily price frame} for the requested symbols.
+
+    Every symbol is cached once with the widest range fetched so far, and any window
+    inside that range is served as a slice of it. Symbols whose cached range does not
+    cover the window are read from the on-disk store and topped up with only the
+    missing days, in batched downloads. Symbols without data map to an empty frame and
+    are not cached, see confirmed_empty and market_data.validate for how unknown tickers
+    are kept from being downloaded over and over. If a top-up fails or runs late,
+    whatever was cached before is returned for that symbol. Symbols dropped from the
+    cache to stay within the memory budget are read back from the store, without a
+    download.
+
+    Concurrent sessions asking for a symbol that is already being topped up for a
+    range covering theirs wait for that top-up instead of starting their own, they are
+    counted as coalesced in fetch_stats. Background fetches (see top_up) don't hold up
+    the downloads of the pages.
+    """
+    symbols = list(dict.fromkeys(symbols))
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    done = threading.Event()
+    with _lock:
+        # The entries are held on to, so they can't be evicted before they are sliced
+        cached = {symbol: _cache.get(symbol) for symbol in symbols}
+        settled = covered_end(start, end)
+        missing = [symbol for symbol in symbols if cached[symbol] is None or not covers(cached[symbol][1], start, settled)]
+        waiting = {symbol: _in_flight[symbol][2] for symbol in missing
+                   if symbol in _in_flight and covers(_in_flight[symbol][:2], start, settled)}
+        missing = [symbol for symbol in missing if symbol not in waiting]
+        for symbol in missing:
+            _in_flight[symbol] = (start, end, done)
+    if waiting:
+        _engine.stats.record_coalesced(waiting)
+    if missing:
+        try:
+            history, coverage = top_up(missing, start, end, background=background)
+            with _lock:
+                for symbol, frame in history.items():
+                    if frame.empty:
+                        if coverage[symbol] is not None:
+                            _empty.put(symbol, coverage[symbol])
+                        continue
+                    cached[symbol] = (frame, coverage[symbol])
+                    _cache.put(symbol, cached[symbol])
+                    if _versioned_coverage.get(symbol) != coverage[symbol]:
+                        _versioned_coverage[symbol] = coverage[symbol]
+                        _versions[symbol] += 1
+        finally:
+            with _lock:
+                for symbol in missing:
+                    if _in_flight.get(symbol, (None, None, None))[2] is done:
+                        del _in_flight[symbol]
+            done.set()
+    # A top-up gives up waiting for its downloads after FETCH_TIMEOUT, so this is only a safety net
+    for event in set(waiting.values()):
+        event.wait(config.FETCH_TIMEOUT)
+    for symbol in waiting:
+        cached[symbol] = _cache.get(symbol) or cached[symbol]
+    return {symbol: slice_history(cached[symbol][0], start, end) if cached[symbol] else empty_history()
+            for symbol in symbols}
+
+
+def history_version(symbol):
+    with _lock:
+        return _versions[symbol]
+
+
+def touch_history(symbols):
+    """Bump the history versions of symbols whose prices changed outside of fetch_prices (see market_data.universe)."""
+    with _lock:
+        for symbol in symbols:
+            _versions[symbol] += 1
+
+
+def cached_history(symbol):
+    """Return the full cached daily history of symbol, an empty frame if it isn't cached or stored."""
+    cached = _cache.get(symbol) or _store.load(symbol)
+    return cached[0] if cached else empty_history()
+
+
+def confirmed_empty(symbol, start_date, end_date):
+    """Return whether the provider answered that symbol has no prices in [start_date, end_date).
+
+    An empty frame from fetch_prices is not an answer when the download failed or ran
+    late, this tells the two apart.
+    """
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    settled = covered_end(start, end)
+    cached = _cache.get(symbol)
+    if cached is not None and covers(cached[1], start, settled):
+        return slice_history(cached[0], start, end).empty
+    return covers(_empty.get(symbol), start, settled)
+
+
+def fetch_stats():
+    """Return per-symbol download counts, failures and latency of this process."""
+    return _engine.stats.snapshot()
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+from market_data.fetch import history_version
+from market_data.instrument import timed
+from market_data.lru import LRUCache
+from market_data.resample import GRANULARITIES, resample_prices
+from market_data.universe import COLUMN as UNIVERSE_COLUMN, current_universe
+
+# Aligned price matrices per (symbols, history versions, start, end, granularity, column)
+_memo = LRUCache(max_entries=128, name="price matrices")
+
+
+def align_columns(series_by_symbol):
+    """Outer join series with different calendars into one Date x Symbol frame.
+
+    The union of all dates is computed once and every series is scattered into a single
+    preallocated float64 block by binary search, so the result is built in one pass.
+    Days on which a symbol did not trade are NaN.
+    """
+    symbols = list(series_by_symbol)
+    if not symbols:
+        return pd.DataFrame(index=pd.DatetimeIndex([], name="Date"), columns=pd.Index([], name="Symbol"), dtype="float64")
+    dates = np.unique(np.concatenate([series.index.to_numpy() for series in series_by_symbol.values()]))
+    values = np.full((len(dates), len(symbols)), np.nan)
+    for position, series in enumerate(series_by_symbol.values()):
+        values[np.searchsorted(dates, series.index.to_numpy()), position] = series.to_numpy(dtype="float64")
+    return pd.DataFrame(values, index=pd.DatetimeIndex(dates, name="Date"), columns=pd.Index(symbols, name="Symbol"))
+
+
+@timed("price_matrix", rows=len)
+def price_matrix(symbols, start_date, end_date, granularity="Daily", column="Close"):
+    """Return one price column of the symbols as an aligned Date x Symbol frame.
+
+    Columns follow the order of symbols, so picking stocks is a column selection. The
+    frame is memoized until the history of one of the symbols changes and is shared
+    between callers, so treat it as read-only. Adjusted closes of symbols in the prebuilt
+    universe (see market_data.universe) are read from it instead of the price history.
+    """
+    symbols = list(dict.fromkeys(symbols))
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    universe = current_universe() if column == UNIVERSE_COLUMN else None
+    if universe is not None and not universe.covers(symbols, start, end):
+        universe = None
+    if universe is not None and GRANULARITIES[granularity] is None:
+        # Daily prices of the prebuilt universe are views of its mapped file, nothing is downloaded or copied
+        return universe.matrix(symbols, start, end)
+    frames = resample_prices(symbols, start, end, granularity) if universe is None else None
+    key = (tuple(symbols), tuple(history_version(symbol) for symbol in symbols), start, end, granularity, column)
+    matrix = _memo.get(key)
+    if matrix is None:
+        if universe is not None:
+            daily = universe.matrix(symbols, start, end)
+            # Periods without a single trading day of any of the symbols carry no price
+            matrix = daily.resample(GRANULARITIES[granularity]).last().dropna(how="all")
+        else:
+            matrix = align_columns({symbol: frames[symbol][column] for symbol in symbols})
+        _memo.put(key, matrix)
+    return matrix
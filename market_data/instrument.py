@@ -0,0 +1,136 @@
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+import pandas as pd
+
+from market_data import config
+
+logger = logging.getLogger(__name__)
+
+# Last RECENT_RERUNS durations per stage of this process, for the percentiles
+RECENT_RERUNS = 1000
+PERCENTILES = [50, 90, 99]
+
+# The rerun being recorded in this thread (Streamlit runs every script run in its own thread)
+_current = contextvars.ContextVar("rerun", default=None)
+_durations = defaultdict(lambda: deque(maxlen=RECENT_RERUNS))
+_lock = threading.Lock()
+
+
+class Rerun:
+    """Stage timings, cache lookups and payload sizes of one run of a page."""
+
+    def __init__(self, page):
+        self.page = page
+        self.started = time.perf_counter()
+        self.seconds = None
+        self.stages = []
+        self.cache = defaultdict(lambda: {"hits": 0, "misses": 0})
+        self._depth = 0
+
+    def report(self):
+        """Return (stages, cache lookups) of the rerun as frames."""
+        stages = pd.DataFrame(self.stages, columns=["stage", "depth", "seconds", "rows", "bytes"])
+        cache = pd.DataFrame([{"cache": cache, "key": key, **counts} for (cache, key), counts in self.cache.items()],
+                             columns=["cache", "key", "hits", "misses"])
+        return stages, cache
+
+
+def start_rerun(page, enabled=False):
+    """Start recording a run of page in this thread if enabled or CASE3_INSTRUMENT is set, return the Rerun or None."""
+    rerun = Rerun(page) if enabled or config.INSTRUMENT else None
+    _current.set(rerun)
+    return rerun
+
+
+def finish_rerun():
+    """Stop recording, log the rerun as one JSON line and add its timings to the process percentiles."""
+    rerun = _current.get()
+    if rerun is None:
+        return None
+    _current.set(None)
+    rerun.seconds = time.perf_counter() - rerun.started
+    with _lock:
+        _durations["rerun"].append(rerun.seconds)
+        for record in rerun.stages:
+            _durations[record["stage"]].append(record["seconds"])
+    logger.info(json.dumps({
+        "page": rerun.page,
+        "seconds": round(rerun.seconds, 6),
+        "stages": rerun.stages,
+        "cache": [{"cache": cache, "key": key, **counts} for (cache, key), counts in rerun.cache.items()],
+    }, default=str))
+    return rerun
+
+
+def payload_size(value):
+    """Return the bytes of a figure or frame as it is sent to the browser (plotly JSON or Arrow)."""
+    if isinstance(value, pd.DataFrame):
+        import pyarrow as pa
+        return pa.Table.from_pandas(value).nbytes
+    return len(value.to_json())
+
+
+@contextlib.contextmanager
+def stage(name, rows=None, payload=None):
+    """Time the block as a stage of the current rerun, with its rows and the bytes of payload.
+
+    The block yields the stage record, so rows can also be set once they are known. Without
+    a rerun being recorded this does nothing.
+    """
+    rerun = _current.get()
+    if rerun is None:
+        yield {}
+        return
+    record = {"stage": name, "depth": rerun._depth, "seconds": None, "rows": rows, "bytes": None}
+    rerun.stages.append(record)
+    rerun._depth += 1
+    started = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = time.perf_counter() - started
+        rerun._depth -= 1
+        if payload is not None:
+            record["bytes"] = payload_size(payload)
+
+
+def timed(name, rows=None):
+    """Decorate a function to be recorded as stage name, rows(result) gives the rows it produced."""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return function(*args, **kwargs)
+            with stage(name) as record:
+                result = function(*args, **kwargs)
+                if rows is not None:
+                    record["rows"] = int(rows(result))
+                return result
+        return wrapper
+    return decorate
+
+
+def cache_lookup(cache, key, hit):
+    """Count a hit or miss of key in the named cache for the current rerun."""
+    rerun = _current.get()
+    if rerun is not None:
+        # Keys hold tuples of symbols and dates, a readable prefix is enough to tell them apart
+        counts = rerun.cache[(cache, repr(key)[:160])]
+        counts["hits" if hit else "misses"] += 1
+
+
+def process_percentiles():
+    """Return the percentiles of the last RECENT_RERUNS durations of every stage of this process."""
+    with _lock:
+        durations = {name: np.array(values) for name, values in _durations.items()}
+    rows = {name: dict(zip(["p{}".format(p) for p in PERCENTILES], np.percentile(values, PERCENTILES)), count=len(values))
+            for name, values in durations.items()}
+    return pd.DataFrame.from_dict(rows, orient="index", columns=["count"] + ["p{}".format(p) for p in PERCENTILES])
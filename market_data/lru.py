@@ -0,0 +1,150 @@
+import itertools
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from market_data import config
+from market_data.instrument import cache_lookup
+
+
+def sizeof(value, depth=0):
+    """Return the approximate number of bytes held by a cached value.
+
+    Frames, series and arrays count their buffers, containers the sum of their items.
+    Other objects count the values of their attributes, one level deep.
+    """
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(sizeof(item, depth) for item in value)
+    if isinstance(value, dict):
+        return sum(sizeof(item, depth) for item in value.values())
+    if depth == 0 and hasattr(value, "__dict__"):
+        return sum(sizeof(item, depth + 1) for item in vars(value).values())
+    return sys.getsizeof(value)
+
+
+class MemoryBudget:
+    """Keeps the caches registered with it within max_bytes together.
+
+    Every cache entry is stamped when it is used, and while the caches hold more than
+    max_bytes the least recently used entry of all of them is dropped.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._caches = {}
+        self._clock = itertools.count()
+        self._lock = threading.Lock()
+
+    def register(self, name, cache):
+        with self._lock:
+            self._caches[name] = cache
+
+    def tick(self):
+        return next(self._clock)
+
+    def enforce(self):
+        with self._lock:
+            caches = list(self._caches.values())
+            used = sum(cache.nbytes for cache in caches)
+            while used > self.max_bytes:
+                stamps = [(cache.oldest(), cache) for cache in caches]
+                stamps = [(stamp, cache) for stamp, cache in stamps if stamp is not None]
+                if not stamps:
+                    break
+                used -= min(stamps, key=lambda item: item[0])[1].pop_oldest()
+
+    def usage(self):
+        """Return entries and bytes per registered cache as a frame, with the budget in its attrs."""
+        with self._lock:
+            rows = [{"cache": name, "entries": len(cache), "bytes": cache.nbytes} for name, cache in self._caches.items()]
+        usage = pd.DataFrame(rows, columns=["cache", "entries", "bytes"]).set_index("cache")
+        usage.attrs["budget"] = self.max_bytes
+        return usage
+
+
+# Shared by every named cache of the process
+_budget = MemoryBudget(config.CACHE_MEMORY_MB * 2 ** 20)
+
+
+class LRUCache:
+    """A thread-safe mapping that drops the least recently used entries beyond max_entries (if not None).
+
+    Caches given a name are also registered with the process-wide memory budget
+    (CACHE_MEMORY_MB), which drops their least recently used entries while all named
+    caches together hold more than the budget, see cache_usage. Their lookups are
+    counted by the instrumentation.
+    """
+
+    def __init__(self, max_entries, name=None):
+        self.max_entries = max_entries
+        self.name = name
+        self.nbytes = 0
+        # key -> [value, bytes, last use]
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._budget = _budget if name is not None else None
+        if self._budget is not None:
+            self._budget.register(name, self)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                if self._budget is not None:
+                    entry[2] = self._budget.tick()
+        if self.name is not None:
+            cache_lookup(self.name, key, entry is not None)
+        return default if entry is None else entry[0]
+
+    def put(self, key, value):
+        size = sizeof(value) if self._budget is not None else 0
+        stamp = self._budget.tick() if self._budget is not None else 0
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries[key][1]
+            self._entries[key] = [value, size, stamp]
+            self._entries.move_to_end(key)
+            self.nbytes += size
+            while self.max_entries is not None and len(self._entries) > self.max_entries:
+                self.nbytes -= self._entries.popitem(last=False)[1][1]
+        # Outside of the lock, the budget takes the locks of all caches in turn
+        if self._budget is not None:
+            self._budget.enforce()
+
+    def oldest(self):
+        """Return the last use of the least recently used entry, None if the cache is empty."""
+        with self._lock:
+            return next(iter(self._entries.values()))[2] if self._entries else None
+
+    def pop_oldest(self):
+        """Drop the least recently used entry and return its size in bytes."""
+        with self._lock:
+            if not self._entries:
+                return 0
+            size = self._entries.popitem(last=False)[1][1]
+            self.nbytes -= size
+            return size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+def cache_usage():
+    """Return entries and bytes of every named cache of this process, the budget is in .attrs["budget"]."""
+    return _budget.usage()
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+
+from market_data.lru import LRUCache
+
+# Rebaser per price matrix, stored with the matrix itself so a reused id() never matches
+_rebasers = LRUCache(max_entries=128, name="rebasers")
+
+
+def forward_fill(values):
+    """Return a copy of a 2-D float array with every NaN replaced by the last valid value above it."""
+    if not len(values):
+        return values.copy()
+    rows = np.maximum.accumulate(np.where(np.isnan(values), 0, np.arange(len(values))[:, None]), axis=0)
+    return np.take_along_axis(values, rows, axis=0)
+
+
+class Rebaser:
+    """Rebases the columns of a Date x Symbol price matrix to 100 at any date.
+
+    The matrix is neither copied nor changed. A forward filled view of its prices is
+    computed once, after that the factors for any rebase date are one binary search
+    and one divide per symbol.
+    """
+
+    def __init__(self, matrix):
+        self.index = matrix.index
+        self.columns = matrix.columns
+        values = matrix.to_numpy(dtype="float64")
+        if not len(values):
+            self._filled = values
+            self._first = np.full(values.shape[1], np.nan)
+            return
+        self._filled = forward_fill(values)
+        # First valid price of every column, used for dates before a stock's first price
+        self._first = values[(~np.isnan(values)).argmax(axis=0), np.arange(values.shape[1])]
+
+    def factors(self, date=None):
+        """Return the factors rebasing every column to 100 at date, the first date by default.
+
+        The price at date is the last one at or before it; columns without a price by then
+        use their first price.
+        """
+        row = 0 if date is None else self.index.searchsorted(pd.Timestamp(date), side="right") - 1
+        base = self._filled[row] if 0 <= row < len(self._filled) else np.full(len(self.columns), np.nan)
+        base = np.where(np.isnan(base), self._first, base)
+        return pd.Series(100 / base, index=self.columns)
+
+
+def rebaser(matrix):
+    """Return the memoized Rebaser of a (cached, read-only) price matrix."""
+    cached = _rebasers.get(id(matrix))
+    if cached is None or cached[0] is not matrix:
+        cached = (matrix, Rebaser(matrix))
+        _rebasers.put(id(matrix), cached)
+    return cached[1]
+
+
+def rebase_factors(matrix, date=None):
+    return rebaser(matrix).factors(date)
+
+
+def normalize(matrix, date=None):
+    """Return a new frame with every column of matrix rebased to 100 at date."""
+    return matrix * rebase_factors(matrix, date)
@@ -0,0 +1,85 @@
+import logging
+import threading
+import time
+
+import pandas as pd
+
+from market_data import config
+from market_data.fetch import fetch_prices
+from market_data.universe import update_universe
+
+logger = logging.getLogger(__name__)
+
+# Progress of the background prefetch, shown in the pages
+_status = {"state": "not started", "last_updated": None, "next_refresh": None, "missing": []}
+_lock = threading.Lock()
+_thread = None
+
+
+def next_refresh(now, refresh_at=config.PREFETCH_REFRESH_AT):
+    """Return the first business day time refresh_at (HH:MM) after now, in the timezone of now."""
+    hour, minute = map(int, refresh_at.split(":"))
+    # Calendar days, not 24 hours, so the refresh stays at the same wall clock time across DST changes
+    refresh = now.replace(hour=hour, minute=minute, second=0, microsecond=0, nanosecond=0)
+    if refresh <= now:
+        refresh += pd.DateOffset(days=1)
+    while refresh.weekday() >= 5:
+        refresh += pd.DateOffset(days=1)
+    return refresh
+
+
+def refresh(symbols=config.PREFETCH_SYMBOLS, days=config.PREFETCH_DAYS):
+    """Load the last days of history of symbols, up to and including today, into the shared cache.
+
+    The range reaches one day past today, so the default date ranges of the pages (which
+    end today) are served from the cache for the rest of the day. The days since the last
+    update are appended to the prebuilt universe as well. The downloads run on the
+    background workers, so they never hold up those of the pages.
+    """
+    today = pd.Timestamp.today().normalize()
+    with _lock:
+        _status["state"] = "refreshing"
+    prices = fetch_prices(symbols, today - pd.Timedelta(days=days), today + pd.Timedelta(days=1), background=True)
+    # The prebuilt universe, if there is one, gets the new day as well
+    update_universe(today + pd.Timedelta(days=1), background=True)
+    with _lock:
+        _status["state"] = "idle"
+        _status["last_updated"] = pd.Timestamp.now(tz=config.PREFETCH_TIMEZONE)
+        _status["missing"] = [symbol for symbol, frame in prices.items() if frame.empty]
+
+
+def run(symbols):
+    while True:
+        try:
+            refresh(symbols)
+        except Exception:
+            # Keep the schedule going, the next refresh may well work
+            logger.exception("Prefetch of %s failed", ", ".join(symbols))
+            with _lock:
+                _status["state"] = "failed"
+        now = pd.Timestamp.now(tz=config.PREFETCH_TIMEZONE)
+        scheduled = next_refresh(now)
+        with _lock:
+            _status["next_refresh"] = scheduled
+        time.sleep((scheduled - now).total_seconds())
+
+
+def start_prefetch(symbols=config.PREFETCH_SYMBOLS):
+    """Start loading symbols in the background and refreshing them after every market close.
+
+    Called by every page, only the first call of a server process starts the thread, so
+    the default universe is loading while the first visitor's page renders and later
+    reruns never wait on the network for it.
+    """
+    global _thread
+    with _lock:
+        if _thread is not None or not symbols:
+            return
+        _thread = threading.Thread(target=run, args=(list(symbols),), name="prefetch", daemon=True)
+        _thread.start()
+
+
+def prefetch_status():
+    """Return a copy of the prefetch status: state, last_updated, next_refresh and symbols without data."""
+    with _lock:
+        return dict(_status, missing=list(_status["missing"]))
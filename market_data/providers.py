@@ -0,0 +1,208 @@
+import contextlib
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+import yfinance as yf
+from yfinance.exceptions import YFRateLimitError
+
+from market_data import config
+from market_data.engine import TransientFetchError
+
+PRICE_COLUMNS = ["Open", "High", "Low", "Close", "Adj Close", "Volume"]
+
+# Per-ticker errors yf.download logs instead of raising: throttling and network failures are worth
+# retrying, NO_DATA_ERRORS tell that Yahoo has no prices for the ticker in the window
+TRANSIENT_ERRORS = re.compile(r"RateLimit|Too Many Requests|Timeout|Timed out|Connection|curl|SSL|Network|HTTPError|"
+                              r"RequestException", re.IGNORECASE)
+NO_DATA_ERRORS = re.compile(r"delisted|no price data|no data found|not found|no timezone", re.IGNORECASE)
+
+
+def empty_history():
+    index = pd.DatetimeIndex([], name="Date")
+    return pd.DataFrame(columns=PRICE_COLUMNS, index=index, dtype="float64")
+
+
+class PriceProvider:
+    """A source of daily OHLCV history.
+
+    download(symbols, start, end) returns {symbol: frame} for the [start, end) window,
+    one frame per symbol with a "Date" index and PRICE_COLUMNS. Symbols the source
+    confirms to have no data in the window map to an empty frame, symbols it couldn't
+    tell about (e.g. a failed request) are left out. Errors worth retrying are raised as
+    TransientFetchError.
+    """
+
+    name = None
+
+    def download(self, symbols, start, end):
+        raise NotImplementedError
+
+
+class DownloadErrors(logging.Handler):
+    """Collects the per-ticker errors yf.download logs instead of raising them.
+
+    yf.download catches the error of every ticker, throttling and network errors
+    included, and logs them from the calling thread once all tickers are done. The
+    errors are collected per thread, so concurrent downloads don't see each other's.
+    """
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self._local = threading.local()
+
+    def emit(self, record):
+        errors = getattr(self._local, "errors", None)
+        if errors is None:
+            return
+        # Logged as "['AAPL', 'MSFT']: <error>", one line per distinct error
+        match = re.match(r"\[(.*?)\]: (.*)", record.getMessage(), re.DOTALL)
+        if match:
+            for ticker in re.findall(r"'([^']*)'", match.group(1)):
+                errors[ticker.upper()] = match.group(2)
+
+    @contextlib.contextmanager
+    def capture(self):
+        """Collect the errors logged by this thread in the block into the yielded {ticker: error}."""
+        self._local.errors = errors = {}
+        try:
+            yield errors
+        finally:
+            self._local.errors = None
+
+
+_download_errors = DownloadErrors()
+logging.getLogger("yfinance").addHandler(_download_errors)
+
+
+class YFinanceProvider(PriceProvider):
+    """Yahoo Finance through yfinance, all symbols of a call in one yf.download request.
+
+    A call where some tickers were throttled or hit a network error raises a
+    TransientFetchError, so the fetch engine retries it with backoff and counts the
+    failure. Tickers Yahoo has no prices for map to an empty frame.
+    """
+
+    name = "yfinance"
+
+    def download(self, symbols, start, end):
+        symbols = list(symbols)
+        try:
+            with _download_errors.capture() as errors:
+                data = yf.download(symbols, start=start, end=end, auto_adjust=False,
+                                   group_by="column", progress=False)
+        except YFRateLimitError as error:
+            raise TransientFetchError(str(error)) from error
+        failed = [symbol for symbol in symbols if TRANSIENT_ERRORS.search(errors.get(symbol.upper(), ""))]
+        if failed:
+            raise TransientFetchError("Download of {} failed: {}".format(", ".join(failed), errors[failed[0].upper()]))
+        return self.split_download(data, symbols, errors)
+
+    @staticmethod
+    def split_download(data, symbols, errors=None):
+        """Split a yf.download result into one daily frame per symbol.
+
+        Symbols without prices map to an empty frame, unless errors ({ticker: error} of
+        the download) holds an error other than Yahoo having no data for them, then they
+        are left out.
+        """
+        errors = errors or {}
+        frames = {}
+        for symbol in symbols:
+            error = errors.get(symbol.upper())
+            if error is None or NO_DATA_ERRORS.search(error):
+                frames[symbol] = empty_history()
+        if data is None or data.empty:
+            return frames
+        if not isinstance(data.columns, pd.MultiIndex):
+            # A single ticker without the ticker level in the columns
+            data = pd.concat({symbols[0]: data}, axis=1).swaplevel(0, 1, axis=1)
+        # yfinance upper-cases the tickers it returns, symbols are matched whatever their case
+        tickers = {ticker.upper(): ticker for ticker in data.columns.get_level_values(1)}
+        for symbol in symbols:
+            if symbol.upper() not in tickers:
+                continue
+            frame = data.xs(tickers[symbol.upper()], axis=1, level=1).dropna(how="all")
+            if frame.empty:
+                continue
+            frame = frame.reindex(columns=PRICE_COLUMNS)
+            frame.index.name = "Date"
+            frame.columns.name = None
+            frames[symbol] = frame
+        return frames
+
+
+class FixtureProvider(PriceProvider):
+    """Offline history for running and profiling the app without network access.
+
+    With a fixture_dir, symbols are read from <fixture_dir>/<symbol>.parquet files with a
+    "Date" index and PRICE_COLUMNS, and symbols without a file have no data. Without one,
+    every symbol gets a synthetic random walk of business days since ORIGIN that is seeded
+    by the symbol, so the same request always returns the same prices. delay (seconds per
+    call) and error_rate (share of calls failing with a TransientFetchError) simulate a
+    slow or unreliable API.
+    """
+
+    name = "fixture"
+    ORIGIN = pd.Timestamp("1990-01-01")
+
+    def __init__(self, fixture_dir=None, delay=0.0, error_rate=0.0, seed=0):
+        self.fixture_dir = fixture_dir
+        self.delay = delay
+        self.error_rate = error_rate
+        self.seed = seed
+        self._random = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+    def download(self, symbols, start, end):
+        if self.delay:
+            time.sleep(self.delay)
+        if self.error_rate:
+            with self._lock:
+                failed = self._random.random() < self.error_rate
+            if failed:
+                raise TransientFetchError("Injected fixture error")
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        frames = {}
+        for symbol in symbols:
+            frame = self.history(symbol, end)
+            frames[symbol] = frame.iloc[frame.index.searchsorted(start):frame.index.searchsorted(end)]
+        return frames
+
+    def history(self, symbol, end):
+        if self.fixture_dir is not None:
+            path = os.path.join(self.fixture_dir, symbol.replace("/", "_") + ".parquet")
+            return pd.read_parquet(path) if os.path.exists(path) else empty_history()
+        return self.synthetic_history(symbol, end)
+
+    def synthetic_history(self, symbol, end):
+        days = np.arange(self.ORIGIN.date(), pd.Timestamp(end).date(), dtype="datetime64[D]")
+        dates = pd.DatetimeIndex(days[np.is_busday(days)].astype("datetime64[ns]"), name="Date")
+        # Random streams are prefix stable, so a longer window repeats the days of a shorter one
+        random = np.random.default_rng([self.seed, zlib.crc32(symbol.encode())])
+        # Everything drawn per symbol comes before the returns, which are as many as the window is long
+        drift = random.uniform(-0.0002, 0.0008)
+        volatility = random.uniform(0.008, 0.03)
+        first_close = random.uniform(10, 500)
+        returns = random.normal(drift, volatility, size=(len(dates), 4))
+        close = first_close * np.exp(np.cumsum(returns[:, 0]))
+        open_ = close * np.exp(returns[:, 1] / 4)
+        high = np.maximum(open_, close) * np.exp(np.abs(returns[:, 2]) / 2)
+        low = np.minimum(open_, close) * np.exp(-np.abs(returns[:, 3]) / 2)
+        volume = np.round(1e6 * np.exp(np.abs(returns[:, 2]) * 20))
+        return pd.DataFrame({"Open": open_, "High": high, "Low": low, "Close": close, "Adj Close": close,
+                             "Volume": volume}, index=dates)
+
+
+def get_provider(name=config.PROVIDER):
+    """Return the provider configured with CASE3_PROVIDER ("yfinance" or "fixture")."""
+    if name == YFinanceProvider.name:
+        return YFinanceProvider()
+    if name == FixtureProvider.name:
+        return FixtureProvider(config.FIXTURE_DIR, config.FIXTURE_DELAY, config.FIXTURE_ERROR_RATE)
+    raise ValueError("Unknown price provider: {}".format(name))
@@ -0,0 +1,61 @@
+import pandas as pd
+
+from market_data.fetch import fetch_prices, history_version
+from market_data.instrument import timed
+from market_data.lru import LRUCache
+
+# Granularities offered in the pages and their pandas resample rules, daily data is used as is
+GRANULARITIES = {
+    "Daily": None,
+    "Weekly": "W-FRI",
+    "Monthly": "ME",
+    "Quarterly": "QE",
+}
+
+AGGREGATIONS = {
+    "Open": "first",
+    "High": "max",
+    "Low": "min",
+    "Close": "last",
+    "Adj Close": "last",
+    "Volume": "sum",
+}
+
+# Resampled frames per (symbol, history version, start, end, granularity)
+_memo = LRUCache(max_entries=512, name="resampled frames")
+
+
+def resample_history(frame, granularity):
+    """Aggregate a daily OHLCV frame to the given granularity, labelled by period end."""
+    rule = GRANULARITIES[granularity]
+    if rule is None:
+        return frame
+    resampled = frame.resample(rule).agg(AGGREGATIONS)
+    # Periods without a single trading day (e.g. before the listing) carry no price
+    return resampled.dropna(subset=["Close"])
+
+
+@timed("resample", rows=lambda result: sum(len(frame) for frame in result.values()))
+def resample_prices(symbols, start_date, end_date, granularity):
+    """Return {symbol: frame} at the given granularity for the [start_date, end_date) window.
+
+    The daily history comes from fetch_prices, so switching granularity never downloads
+    anything; resampled frames are memoized until the underlying history changes.
+    Daily frames are slices of the cached history and are not memoized again.
+
+    Memoized frames are float32, which keeps about 7 significant digits, plenty for
+    prices and volumes that are only charted and compared.
+    """
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    daily = fetch_prices(symbols, start, end)
+    if GRANULARITIES[granularity] is None:
+        return daily
+    result = {}
+    for symbol, frame in daily.items():
+        key = (symbol, history_version(symbol), start, end, granularity)
+        resampled = _memo.get(key)
+        if resampled is None:
+            resampled = resample_history(frame, granularity).astype("float32")
+            _memo.put(key, resampled)
+        result[symbol] = resampled
+    return result
@@ -0,0 +1,136 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from market_data.analytics import BENCHMARK, TRADING_DAYS
+from market_data.fetch import cached_history, fetch_prices, history_version
+from market_data.frame import align_columns
+from market_data.instrument import timed
+from market_data.lru import LRUCache
+from market_data.normalize import forward_fill
+from market_data.universe import COLUMN as UNIVERSE_COLUMN, current_universe
+
+ROLLING_METRICS = ["Beta", "Volatility", "Correlation"]
+# Window lengths in trading days offered in the pages
+ROLLING_WINDOWS = [60, 120, 252]
+
+# RollingSums per (symbol, benchmark, column) with the history versions they were built from
+_states = LRUCache(max_entries=256, name="rolling sums")
+_states_lock = threading.Lock()
+# Rolling metric matrices per (symbols, history versions, start, end, metric, window, benchmark, column)
+_memo = LRUCache(max_entries=64, name="rolling matrices")
+
+
+def return_terms(prices):
+    """Return the per-day [valid, r, m, r*r, m*m, r*m] terms of the daily returns of (stock, market) prices.
+
+    Row i holds the returns from day i to day i + 1, days without a return of both count as invalid.
+    """
+    returns = prices[1:] / prices[:-1] - 1
+    valid = ~np.isnan(returns).any(axis=1)
+    stock = np.where(valid, returns[:, 0], 0)
+    market = np.where(valid, returns[:, 1], 0)
+    return np.column_stack([valid, stock, market, stock * stock, market * market, stock * market])
+
+
+class RollingSums:
+    """Running sums of a stock's and the market's daily returns for rolling window metrics.
+
+    Cumulative sums of the return terms are kept for the whole history, so the sums over
+    any window are the difference of two rows. When the history grows by new daily bars,
+    only the sums of the new tail (and of the last known bar, which may have been
+    re-fetched) are computed. Instances are not changed once built, so they can be
+    shared between sessions.
+    """
+
+    def __init__(self, dates, sums):
+        self.dates = dates
+        self.sums = sums
+
+    @classmethod
+    def build(cls, dates, prices, previous=None):
+        """Return the sums for (dates, forward filled (stock, market) prices).
+
+        If previous holds the sums of an earlier, shorter version of the same history,
+        its sums are reused up to the last bar it knew.
+        """
+        known = 0 if previous is None else len(previous.dates)
+        # Only history growing at the tail is updated incrementally, anything else is rebuilt
+        if (known >= 2 and len(dates) >= known and dates[0] == previous.dates[0]
+                and dates[known - 2] == previous.dates[known - 2]):
+            keep = known - 1
+            tail = np.cumsum(return_terms(prices[keep - 1:]), axis=0) + previous.sums[keep - 1]
+            return cls(dates, np.concatenate([previous.sums[:keep], tail]))
+        terms = return_terms(prices) if len(prices) else np.empty((0, 6))
+        return cls(dates, np.concatenate([np.zeros((1, 6)), np.cumsum(terms, axis=0)]))
+
+    def metrics(self, window, start, end):
+        """Return a frame of ROLLING_METRICS over the last window returns at every day in [start, end).
+
+        Days without window returns of both the stock and the market are NaN.
+        """
+        lo, hi = self.dates.searchsorted(start), self.dates.searchsorted(end)
+        rows = np.arange(lo, hi)
+        sums = np.full((len(rows), 6), np.nan)
+        full = rows >= window
+        sums[full] = self.sums[rows[full]] - self.sums[rows[full] - window]
+        count, stock, market, stock_squares, market_squares, products = sums.T
+        with np.errstate(divide="ignore", invalid="ignore"):
+            count = np.where(count >= window, count, np.nan)
+            stock_variance = (stock_squares - stock * stock / count) / (count - 1)
+            market_variance = (market_squares - market * market / count) / (count - 1)
+            covariance = (products - stock * market / count) / (count - 1)
+            return pd.DataFrame({
+                "Beta": covariance / market_variance,
+                "Volatility": np.sqrt(stock_variance * TRADING_DAYS),
+                "Correlation": covariance / np.sqrt(stock_variance * market_variance),
+            }, index=self.dates[lo:hi])
+
+
+def rolling_sums(symbol, benchmark=BENCHMARK, column="Adj Close", universe=None):
+    """Return the RollingSums of symbol against benchmark over their full cached history.
+
+    With a universe holding both (see market_data.universe), its history is used instead.
+    """
+    versions = (history_version(symbol), history_version(benchmark), universe is not None)
+    with _states_lock:
+        cached = _states.get((symbol, benchmark, column))
+        if cached is not None and cached[0] == versions:
+            return cached[1]
+        if universe is not None:
+            matrix = align_columns({symbol: universe.series(symbol), benchmark: universe.series(benchmark)})
+        else:
+            matrix = align_columns({symbol: cached_history(symbol)[column], benchmark: cached_history(benchmark)[column]})
+        # The benchmark against itself is a single column used for both sides
+        prices = forward_fill(matrix[[symbol, benchmark]].to_numpy())
+        state = RollingSums.build(matrix.index, prices, cached[1] if cached else None)
+        _states.put((symbol, benchmark, column), (versions, state))
+        return state
+
+
+@timed("rolling_matrix", rows=len)
+def rolling_matrix(symbols, start_date, end_date, metric, window, benchmark=BENCHMARK, column="Adj Close"):
+    """Return one rolling metric against benchmark as a Date x Symbol frame for [start_date, end_date).
+
+    Windows reach back before start_date where the cached history allows it. Results are
+    memoized until the price history of one of the symbols or the benchmark changes.
+    Symbols of the prebuilt universe are computed from it without loading their history.
+    """
+    symbols = list(dict.fromkeys(symbols))
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    universe = current_universe() if column == UNIVERSE_COLUMN else None
+    if universe is not None and not universe.covers(symbols + [benchmark], start, end):
+        universe = None
+    if universe is None:
+        fetch_prices(symbols + [benchmark], start, end)
+    versions = tuple(history_version(symbol) for symbol in symbols + [benchmark])
+    key = (tuple(symbols), versions, start, end, metric, window, benchmark, column)
+    matrix = _memo.get(key)
+    if matrix is None:
+        series = {}
+        for symbol in symbols:
+            series[symbol] = rolling_sums(symbol, benchmark, column, universe).metrics(window, start, end)[metric]
+        matrix = align_columns(series)
+        _memo.put(key, matrix)
+    return matrix
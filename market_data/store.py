@@ -0,0 +1,99 @@
+import contextlib
+import json
+import os
+
+import pandas as pd
+import pyarrow as pa
+
+from market_data.config import STORE_DIR
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Key of the schema metadata entry holding the date range a file has been fetched for
+COVERAGE_KEY = b"case3.coverage"
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on path, across threads and processes, for the duration of the block."""
+    with open(path, "a+b") as handle:
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        else:
+            handle.seek(0)
+            # LK_LOCK gives up after about 10 seconds, a download may well take longer
+            while True:
+                try:
+                    msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+            else:
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class PriceStore:
+    """Daily price history on disk, one Arrow IPC file per symbol.
+
+    Besides the rows, every file records the [start, end) range that has been requested
+    from the API for it, so days without trading (weekends, holidays, before the listing)
+    are not fetched again.
+
+    The store can be shared by several server processes on one volume. Files are memory
+    mapped when read, so the columns of a loaded frame are backed by the page cache that
+    all processes share instead of a private copy each. Writers hold a per-symbol lock
+    (see lock), which lets a process wait for another one already downloading a symbol
+    and then read its result instead of downloading it again.
+    """
+
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+
+    def path(self, symbol):
+        # Index tickers like ^GSPC are fine on disk, path separators are not
+        return os.path.join(self.root, symbol.replace("/", "_") + ".arrow")
+
+    def load(self, symbol):
+        """Return (frame, (start, end)) for a stored symbol, or None if nothing is stored."""
+        path = self.path(symbol)
+        if not os.path.exists(path):
+            return None
+        table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        coverage = json.loads(table.schema.metadata[COVERAGE_KEY])
+        # One block per column keeps the float columns as views of the mapped file
+        frame = table.to_pandas(split_blocks=True).set_index("Date")
+        return frame, (pd.Timestamp(coverage["start"]), pd.Timestamp(coverage["end"]))
+
+    def save(self, symbol, frame, coverage):
+        os.makedirs(self.root, exist_ok=True)
+        # NaN stays NaN instead of becoming null, so the columns can be read back without a copy
+        arrays = [pa.array(frame.index.to_numpy())]
+        arrays += [pa.array(frame[column].to_numpy(), from_pandas=False) for column in frame.columns]
+        metadata = {COVERAGE_KEY: json.dumps({"start": coverage[0].isoformat(), "end": coverage[1].isoformat()})}
+        table = pa.table(arrays, names=["Date"] + list(frame.columns), metadata=metadata)
+        # Write next to the target and rename so readers never see a half written file
+        path = self.path(symbol)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with pa.OSFile(tmp_path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
+
+    @contextlib.contextmanager
+    def lock(self, symbols):
+        """Hold the write locks of symbols, taken in sorted order so processes never deadlock."""
+        os.makedirs(self.root, exist_ok=True)
+        with contextlib.ExitStack() as stack:
+            for symbol in sorted(set(symbols)):
+                stack.enter_context(file_lock(self.path(symbol) + ".lock"))
+            yield
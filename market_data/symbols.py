@@ -0,0 +1,129 @@
+import bisect
+import re
+import threading
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+from market_data import config
+
+# Share of the trigrams of a query a listing must contain to count as a fuzzy match
+FUZZY_THRESHOLD = 0.5
+
+_index = None
+_lock = threading.Lock()
+
+
+def normalize_text(text):
+    """Lower case text with punctuation turned into single spaces, as names are matched."""
+    return " ".join(re.sub(r"[^0-9a-z^]+", " ", text.lower()).split())
+
+
+def trigrams(text):
+    padded = "  {} ".format(text)
+    return {padded[position:position + 3] for position in range(len(padded) - 2)}
+
+
+class SymbolIndex:
+    """Search over a symbol master of tickers and company names, without the network.
+
+    Prefix search works on sorted keys: the keys starting with a prefix are one
+    contiguous range found by two binary searches, like the subtree of a trie. Tickers,
+    full names and every word of a name are keys, so "app", "apple" and "micro" find
+    their listings. Fuzzy search counts the trigrams a listing shares with the query
+    from an inverted index, which tolerates typos like "microsfot".
+    """
+
+    def __init__(self, listings):
+        self.symbols = listings["Symbol"].astype(str).str.strip().str.upper().tolist()
+        self.names = listings["Name"].fillna("").astype(str).tolist()
+        self._positions = {symbol: position for position, symbol in enumerate(self.symbols)}
+
+        ticker_keys = sorted((symbol.lower(), position) for position, symbol in enumerate(self.symbols))
+        self._ticker_keys = [key for key, _ in ticker_keys]
+        self._ticker_ids = [position for _, position in ticker_keys]
+        name_keys = []
+        postings = defaultdict(list)
+        sizes = []
+        for position, (symbol, name) in enumerate(zip(self.symbols, self.names)):
+            words = normalize_text(name).split()
+            # The full name covers its first word, later words are keys of their own
+            name_keys += [(" ".join(words[start:]), position) for start in range(len(words))]
+            grams = trigrams(symbol.lower()) | trigrams(" ".join(words))
+            for gram in grams:
+                postings[gram].append(position)
+            sizes.append(len(grams))
+        name_keys.sort()
+        self._name_keys = [key for key, _ in name_keys]
+        self._name_ids = [position for _, position in name_keys]
+        self._postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+        self._sizes = np.array(sizes)
+
+    @classmethod
+    def from_csv(cls, path):
+        """Load a symbol master with Symbol and Name columns."""
+        return cls(pd.read_csv(path, usecols=["Symbol", "Name"], dtype=str))
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def lookup(self, symbol):
+        """Return the name of a listed symbol, None if it isn't listed."""
+        position = self._positions.get(symbol.strip().upper())
+        return None if position is None else self.names[position]
+
+    def prefix(self, keys, ids, text, limit):
+        lo = bisect.bisect_left(keys, text)
+        hi = bisect.bisect_left(keys, text + "\uffff", lo)
+        return ids[lo:min(hi, lo + limit)]
+
+    def fuzzy(self, text, limit):
+        grams = trigrams(text)
+        found = [self._postings[gram] for gram in grams if gram in self._postings]
+        if not found:
+            return []
+        shared = np.bincount(np.concatenate(found), minlength=len(self.symbols))
+        # Listings containing most of the query, the closest in size (Jaccard similarity) first
+        candidates = np.flatnonzero(shared >= FUZZY_THRESHOLD * len(grams))
+        score = shared[candidates] / (len(grams) + self._sizes[candidates] - shared[candidates])
+        if len(candidates) > limit:
+            best = np.argpartition(-score, limit)[:limit]
+            candidates, score = candidates[best], score[best]
+        return [int(position) for position in candidates[np.argsort(-score, kind="stable")]]
+
+    def search(self, query, limit=10):
+        """Return up to limit (symbol, name) listings matching query, best matches first.
+
+        The exact ticker comes first, then tickers and names starting with the query.
+        Fuzzy matches fill the remaining places.
+        """
+        ticker = query.strip().lower()
+        text = normalize_text(query)
+        if not ticker:
+            return []
+        positions = []
+        if ticker.upper() in self._positions:
+            positions.append(self._positions[ticker.upper()])
+        # Shorter tickers sort first, so "A" ranks above "AAPL" for "a"
+        positions += self.prefix(self._ticker_keys, self._ticker_ids, ticker, limit)
+        if text:
+            positions += self.prefix(self._name_keys, self._name_ids, text, limit)
+        positions = list(dict.fromkeys(positions))
+        if text and len(positions) < limit:
+            positions = list(dict.fromkeys(positions + self.fuzzy(text, limit)))
+        positions = positions[:limit]
+        return [(self.symbols[position], self.names[position]) for position in positions]
+
+
+def symbol_index():
+    """Return the SymbolIndex of the symbol master (CASE3_SYMBOLS_FILE), loaded once per process."""
+    global _index
+    with _lock:
+        if _index is None:
+            _index = SymbolIndex.from_csv(config.SYMBOLS_FILE)
+        return _index
+
+
+def search_symbols(query, limit=10):
+    return symbol_index().search(query, limit)
@@ -0,0 +1,252 @@
+"""Daily adjusted closes of a whole ticker universe in one memory-mapped file.
+
+The universe is a Date x Symbol matrix of float64 adjusted closes on a shared date axis,
+stored column by column (Fortran order) with spare rows, so the history of a symbol is
+one contiguous run of the file and a new day is written into the spare rows without
+rewriting anything. Selecting symbols in the pages is a view of their columns: nothing
+is downloaded or copied, whatever the size of the universe.
+
+The universe is built and updated with python -m market_data.universe_cli, the update
+is also run by the post-close refresh of the background prefetch.
+"""
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from market_data import config
+from market_data.fetch import REVISION_TOLERANCE, covered_end, slice_history, top_up, touch_history
+from market_data.store import file_lock
+
+logger = logging.getLogger(__name__)
+
+# The only price column held for the universe
+COLUMN = "Adj Close"
+META_FILE = "universe.json"
+
+_current = None
+_current_stamp = None
+_lock = threading.Lock()
+
+
+class Universe:
+    """Read-only view of a universe directory as of its last build or update."""
+
+    def __init__(self, root, meta):
+        self.root = root
+        self.symbols = meta["symbols"]
+        self.start = pd.Timestamp(meta["start"])
+        self.end = pd.Timestamp(meta["end"])
+        self.rows = meta["rows"]
+        self._columns = {symbol: position for position, symbol in enumerate(self.symbols)}
+        self.dates = pd.DatetimeIndex(np.load(os.path.join(root, meta["dates"]), mmap_mode="r")[:self.rows], name="Date")
+        values = np.memmap(os.path.join(root, meta["values"]), dtype="float64", mode="r",
+                           shape=(meta["capacity"], len(self.symbols)), order="F")
+        self.values = values[:self.rows]
+
+    def __contains__(self, symbol):
+        return symbol in self._columns
+
+    def covers(self, symbols, start, end):
+        """Return whether all symbols are in the universe and its dates cover [start, end)."""
+        symbols = list(symbols)
+        return bool(symbols) and all(symbol in self._columns for symbol in symbols) and self.start <= start and end <= self.end
+
+    def series(self, symbol):
+        """Return the full history of symbol as a series backed by the mapped file."""
+        return pd.Series(self.values[:, self._columns[symbol]], index=self.dates, name=symbol, copy=False)
+
+    def matrix(self, symbols, start, end):
+        """Return the [start, end) window of symbols as a Date x Symbol frame of views of the mapped file."""
+        lo, hi = self.dates.searchsorted(start), self.dates.searchsorted(end)
+        columns = {symbol: self.values[lo:hi, self._columns[symbol]] for symbol in symbols}
+        matrix = pd.DataFrame(columns, index=self.dates[lo:hi], columns=list(symbols), copy=False)
+        matrix.columns.name = "Symbol"
+        return matrix
+
+
+def read_meta(root):
+    path = os.path.join(root, META_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+
+def write_meta(root, meta):
+    # Data is written before the metadata that makes it visible, and the metadata is replaced in one go
+    path = os.path.join(root, META_FILE)
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "w") as file:
+        json.dump(meta, file)
+    os.replace(tmp_path, path)
+
+
+def allocate(root, symbols, capacity, generation):
+    """Create empty date and value files for capacity rows, named by generation so readers of older ones keep working."""
+    dates_name = "dates-{}.npy".format(generation)
+    values_name = "values-{}.f8".format(generation)
+    dates = np.lib.format.open_memmap(os.path.join(root, dates_name), mode="w+", dtype="datetime64[ns]",
+                                      shape=(capacity,))
+    values = np.memmap(os.path.join(root, values_name), dtype="float64", mode="w+",
+                       shape=(capacity, len(symbols)), order="F")
+    return dates_name, values_name, dates, values
+
+
+def fetch_closes(symbols, start, end, batch_size, background=False):
+    """Return (matrix, failed): the adjusted closes of symbols in [start, end) as one aligned matrix and the
+    symbols whose download failed, which have an empty column. Symbols are read in batches that wait for
+    their downloads, on the background workers if background (see fetch.top_up).
+    """
+    series = {}
+    for position in range(0, len(symbols), batch_size):
+        batch = symbols[position:position + batch_size]
+        history, _ = top_up(batch, start, end, timeout=None, background=background)
+        for symbol in batch:
+            if symbol in history:
+                series[symbol] = slice_history(history[symbol], start, end)[COLUMN]
+    failed = [symbol for symbol in symbols if symbol not in series]
+    # Built once per update, so the outer join of pandas is fast enough
+    matrix = pd.DataFrame({symbol: series.get(symbol, pd.Series(dtype="float64")) for symbol in symbols}, dtype="float64")
+    return matrix.sort_index(), failed
+
+
+def build_universe(symbols, start, end, root=config.UNIVERSE_DIR, batch_size=100):
+    """Write the universe of symbols for [start, end) to root, replacing what was there.
+
+    Symbols without any data in the range are left out, so their prices are fetched as
+    usual. Returns the symbols of the universe.
+    """
+    symbols = list(dict.fromkeys(symbols))
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    os.makedirs(root, exist_ok=True)
+    with file_lock(os.path.join(root, "universe.lock")):
+        matrix, _ = fetch_closes(symbols, start, end, batch_size)
+        missing = [symbol for symbol in symbols if matrix[symbol].isna().all()]
+        if missing:
+            logger.warning("No data for %s, left out of the universe", ", ".join(missing))
+            matrix = matrix.drop(columns=missing).dropna(how="all")
+            symbols = list(matrix.columns)
+        previous = read_meta(root)
+        generation = previous["generation"] + 1 if previous else 0
+        # A year of spare rows for the daily updates
+        capacity = len(matrix) + 260
+        dates_name, values_name, dates, values = allocate(root, symbols, capacity, generation)
+        dates[:len(matrix)] = matrix.index.to_numpy()
+        values[:len(matrix)] = matrix.to_numpy()
+        dates.flush()
+        values.flush()
+        write_meta(root, {"symbols": symbols, "start": start.isoformat(), "end": covered_end(start, end).isoformat(),
+                          "rows": len(matrix), "capacity": capacity, "generation": generation, "dates": dates_name,
+                          "values": values_name})
+        remove_stale(root, {dates_name, values_name})
+    return symbols
+
+
+def update_universe(end=None, root=config.UNIVERSE_DIR, batch_size=100, background=False):
+    """Append the days from the last update up to end (tomorrow by default) to the universe in root.
+
+    Only the new days, and the last settled day and those after it which may have been an
+    unfinished session, are downloaded. If the last settled close of a symbol changed since,
+    a split or a dividend revised its history, and its whole column is written again. If
+    the download of a symbol fails, nothing is written and the next update tries the same
+    days again. Returns the number of days written, None if there is no universe in root.
+    The downloads run on the background workers if background, see fetch.top_up.
+    """
+    end = pd.Timestamp(end) if end is not None else pd.Timestamp.today().normalize() + pd.Timedelta(days=1)
+    if read_meta(root) is None:
+        return None
+    with file_lock(os.path.join(root, "universe.lock")):
+        # Another process may have updated the universe while this one waited for the lock
+        meta = read_meta(root)
+        if end <= pd.Timestamp(meta["end"]):
+            return 0
+        current = Universe(root, meta)
+        # From the last settled day on, which tells whether the history was revised since
+        settled = int(current.dates.searchsorted(pd.Timestamp(meta["end"])))
+        start = current.dates[settled - 1] if settled else current.start
+        matrix, failed = fetch_closes(meta["symbols"], start, end, batch_size, background)
+        if failed:
+            logger.warning("Failed to download %s, the universe is not updated", ", ".join(failed))
+            return 0
+        if matrix.empty:
+            return 0
+        revisions = []
+        if settled and start in matrix.index:
+            changed = ~np.isclose(matrix.loc[start].to_numpy(), current.values[settled - 1],
+                                  rtol=REVISION_TOLERANCE, equal_nan=True)
+            revisions = [symbol for symbol, revised in zip(meta["symbols"], changed) if revised]
+        if revisions:
+            # Splits and dividends change every earlier close, the whole history of these symbols is written again
+            logger.info("Price history of %s was revised, writing it again", ", ".join(revisions))
+            history, failed = fetch_closes(revisions, current.start, end, batch_size, background)
+            if failed:
+                logger.warning("Failed to download %s, the universe is not updated", ", ".join(failed))
+                return 0
+        # Re-fetched days are written over their old rows
+        rows = int(current.dates.searchsorted(matrix.index[0]))
+        if rows + len(matrix) > meta["capacity"]:
+            # Out of spare rows: copy into files twice the size, once every few years of updates
+            capacity = 2 * (rows + len(matrix))
+            generation = meta["generation"] + 1
+            dates_name, values_name, dates, values = allocate(root, meta["symbols"], capacity, generation)
+            dates[:rows] = current.dates[:rows].to_numpy()
+            values[:rows] = current.values[:rows]
+            meta.update(capacity=capacity, generation=generation, dates=dates_name, values=values_name)
+        else:
+            dates = np.load(os.path.join(root, meta["dates"]), mmap_mode="r+")
+            values = np.memmap(os.path.join(root, meta["values"]), dtype="float64", mode="r+",
+                               shape=(meta["capacity"], len(meta["symbols"])), order="F")
+        dates[rows:rows + len(matrix)] = matrix.index.to_numpy()
+        values[rows:rows + len(matrix)] = matrix.to_numpy()
+        if revisions:
+            history = history.reindex(pd.DatetimeIndex(dates[:rows + len(matrix)]))
+            for symbol in revisions:
+                values[:rows + len(matrix), current._columns[symbol]] = history[symbol].to_numpy()
+        dates.flush()
+        values.flush()
+        # Like the price store, the universe only covers days whose bar is final, the update re-fetches the others
+        meta.update(rows=rows + len(matrix), end=covered_end(start, end).isoformat())
+        write_meta(root, meta)
+        remove_stale(root, {meta["dates"], meta["values"]})
+    return len(matrix)
+
+
+def remove_stale(root, keep):
+    """Remove date and value files of older generations, processes still mapping them keep their data."""
+    for name in os.listdir(root):
+        if name.startswith(("dates-", "values-")) and name not in keep:
+            try:
+                os.remove(os.path.join(root, name))
+            except OSError:
+                # Mapped files can't be removed on Windows, they go with a later update
+                pass
+
+
+def current_universe(root=config.UNIVERSE_DIR):
+    """Return the Universe in root as of its last build or update, None if there is none.
+
+    The Universe is reopened once the metadata changes, and the history versions of its
+    symbols are bumped then, so everything memoized from the older days is rebuilt.
+    """
+    global _current, _current_stamp
+    path = os.path.join(root, META_FILE)
+    try:
+        stamp = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    with _lock:
+        if stamp != _current_stamp:
+            _current = Universe(root, read_meta(root))
+            _current_stamp = stamp
+            touch_history(_current.symbols)
+        return _current
+
+
+def universe_symbols():
+    """Return the symbols of the prebuilt universe, none if it wasn't built."""
+    universe = current_universe()
+    return list(universe.symbols) if universe is not None else []
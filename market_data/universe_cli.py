@@ -0,0 +1,55 @@
+"""Build or update the prebuilt universe of daily adjusted closes (see market_data.universe).
+
+    python -m market_data.universe_cli build --tickers-file sp500.txt --start 2000-01-01
+    python -m market_data.universe_cli update
+
+Build downloads (or reads from the price store) the history of every symbol, the symbol
+master by default; update appends the days since the last build or update, as the
+post-close refresh of the background prefetch does.
+"""
+import argparse
+import logging
+import sys
+from datetime import datetime, timedelta
+
+from market_data import config
+from market_data.export import read_tickers
+from market_data.universe import build_universe, update_universe
+
+logger = logging.getLogger(__name__)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Build the universe from scratch")
+    build.add_argument("tickers", nargs="*", help="Tickers of the universe, added to those of --tickers-file")
+    build.add_argument("--tickers-file", help="File with one ticker per line, or a CSV file with a Symbol column "
+                                              "(the symbol master by default)")
+    build.add_argument("--start", default="2000-01-01")
+    build.add_argument("--end", default=str(datetime.today().date() + timedelta(days=1)))
+    build.add_argument("--batch-size", type=int, default=100)
+    update = commands.add_parser("update", help="Append the days since the last build or update")
+    update.add_argument("--end", help="Exclusive end date, tomorrow by default")
+    update.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    if args.command == "build":
+        tickers = list(args.tickers)
+        if args.tickers_file or not tickers:
+            tickers += read_tickers(args.tickers_file or config.SYMBOLS_FILE)
+        tickers = list(dict.fromkeys(ticker.strip().upper() for ticker in tickers))
+        symbols = build_universe(tickers, args.start, args.end, batch_size=args.batch_size)
+        logger.info("Built the universe of %s of %s tickers in %s", len(symbols), len(tickers), config.UNIVERSE_DIR)
+        # A nightly job should notice when nothing could be loaded at all
+        return 0 if symbols else 1
+    rows = update_universe(args.end, batch_size=args.batch_size)
+    if rows is None:
+        parser.error("there is no universe in {}, build it first".format(config.UNIVERSE_DIR))
+    logger.info("Wrote %s days to the universe in %s", rows, config.UNIVERSE_DIR)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
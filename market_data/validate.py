@@ -0,0 +1,43 @@
+import threading
+import time
+
+import pandas as pd
+
+from market_data.fetch import cached_history, confirmed_empty, fetch_prices, slice_history
+
+# Seconds a rejected ticker is answered from memory before the API is asked again
+NEGATIVE_TTL = 15 * 60
+
+# Expiry time (time.monotonic) of every rejected ticker
+_rejected = {}
+_lock = threading.Lock()
+
+
+def normalize_ticker(text):
+    return text.strip().upper()
+
+
+def validate_ticker(symbol, start_date, end_date):
+    """Return whether symbol has price data in the [start_date, end_date) window.
+
+    Prices already cached or stored answer without a download. Otherwise the check is a
+    regular fetch_prices call, so the history downloaded for a valid ticker is already
+    cached when it gets plotted and adding a ticker costs exactly one fetch. Tickers the
+    provider confirmed to have no data are remembered for NEGATIVE_TTL seconds and not
+    fetched again during that time; a failed or late download rejects the ticker only
+    this once.
+    """
+    if not slice_history(cached_history(symbol), pd.Timestamp(start_date), pd.Timestamp(end_date)).empty:
+        return True
+    now = time.monotonic()
+    with _lock:
+        expires = _rejected.get(symbol)
+        if expires is not None and expires > now:
+            return False
+    valid = not fetch_prices([symbol], start_date, end_date)[symbol].empty
+    with _lock:
+        if valid:
+            _rejected.pop(symbol, None)
+        elif confirmed_empty(symbol, start_date, end_date):
+            _rejected[symbol] = now + NEGATIVE_TTL
+    return valid
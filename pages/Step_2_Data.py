@@ -1,9 +1,9 @@
 import pandas as pd
 import streamlit as st
 import plotly.express as px
-import yfinance as yf
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
+from market_data import compact_figure, fetch_prices, resample_prices, start_prefetch
 
 st.set_page_config(layout="wide")
 hide_st_style = """
@@ -15,6 +15,9 @@ hide_st_style = """
             """
 st.markdown(hide_st_style, unsafe_allow_html=True)
 
+# Keeps the default stocks loaded and refreshed after the market close (only the first call starts it)
+start_prefetch()
+
 
 st.header("Step 2. Data")
 st.write("""We did a lot of things, let's come back to our initial plan and check what should we figure out next.
@@ -60,10 +63,15 @@ st.code("""
    st.dataframe(tickerDf)
    """, language='python')
 
-tickerDf = yf.download(tickerSymbol, start='2010-5-31', end='2023-5-31')
+tickerDf = fetch_prices([tickerSymbol], '2010-5-31', '2023-5-31')[tickerSymbol]  # Same data as yf.download, through the configured price provider and cache
 
 st.subheader("Complete historical data")
-st.dataframe(tickerDf.head())
+# Only the page of rows being looked at is sent to the browser, not the whole history
+page_size = 50
+page_count = max(1, -(-len(tickerDf) // page_size))
+page = st.number_input("Page", min_value=1, max_value=page_count, value=1)
+st.dataframe(tickerDf.iloc[(page - 1) * page_size:page * page_size])
+st.caption("Page {} of {}, {} rows in total".format(page, page_count, len(tickerDf)))
 
 st.markdown("## 4. Plotting data using Plotly")
 st.code("""
@@ -71,9 +79,9 @@ fig = px.line(tickerDf, x=tickerDf.index, y="Close", title='Apple Close Price Ov
 st.plotly_chart(fig)
 """, language='python')
 
-# Plotting data using plotly
+# Plotting data using plotly, the prices are sent to the browser as binary arrays
 fig = px.line(tickerDf, x=tickerDf.index, y="Close", title='Apple Close Price Over Time')
-st.plotly_chart(fig)
+st.plotly_chart(compact_figure(fig))
 
 st.markdown("## Full Code:")
 st.code("""
@@ -155,10 +163,8 @@ for stock in stocks.values():
 st.dataframe(df.head(20))
    """, language='python')
 
-@st.cache_data
 def fetch_data(stock, start_date, end_date):
-    stock_data = yf.download(stock, start=start_date, end=end_date)["Close"]  # Adjust the date range as needed
-    stock_data = stock_data.resample('M').last() # Resample data to get the last price of each month
+    stock_data = resample_prices([stock], start_date, end_date, "Monthly")[stock]["Close"]  # Last price of each month, resampled from the cached daily history
     stock_data = stock_data.reset_index()
     stock_data["Symbol"] = stock
     return stock_data
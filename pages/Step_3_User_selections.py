@@ -1,9 +1,9 @@
 import pandas as pd
 import streamlit as st
 import plotly.express as px
-import yfinance as yf
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
+from market_data import GRANULARITIES, price_chart, start_prefetch
 
 st.set_page_config(layout="wide")
 hide_st_style = """
@@ -15,6 +15,9 @@ hide_st_style = """
             """
 st.markdown(hide_st_style, unsafe_allow_html=True)
 
+# Keeps the default stocks loaded and refreshed after the market close (only the first call starts it)
+start_prefetch()
+
 stocks = {
     "Apple": "AAPL",
     "Google": "GOOGL",
@@ -23,24 +26,10 @@ stocks = {
     "S&P 500": "^GSPC"
 }
 
-@st.cache_data
-def fetch_data(stock, start_date, end_date):
-    stock_data = yf.download(stock, start=start_date, end=end_date)["Close"]
-    stock_data = stock_data.resample('M').last()
-    stock_data = stock_data.reset_index()
-    stock_data["Symbol"] = stock
-    return stock_data
-
-def get_stock_data(stocks, start_date, end_date):
-    df = pd.DataFrame()
-    for stock in stocks.values():
-        df = pd.concat([df, fetch_data(stock, start_date, end_date)])
-    return df
-
-def draw_plot(dfs):
-    fig = go.Figure()
-    for stock, df in dfs.items():
-        fig = fig.add_trace(go.Scatter(x=df["Date"], y=df["Close"], name=stock))
+def draw_plot(stocks, start_date, end_date, granularity="Monthly", normalize=False):
+    # Close prices are downloaded in one request and resampled from the cached daily history. The figure is
+    # memoized on its inputs, long daily histories are downsampled to about one point per pixel
+    fig = price_chart(stocks, start_date, end_date, granularity, "Close", normalize)
     st.plotly_chart(fig)
 
 st.header("Step 3. User selections and final touches")
@@ -68,11 +57,6 @@ twenty_years_ago = today - timedelta(days=20*365)
 date_range = st.date_input("Date range", [twenty_years_ago, today])  
 """, language='python')
 st.markdown("We've used Streamlit's date_input function to select a range for which to fetch stock data.")
-today = datetime.today().date()
-twenty_years_ago = today - timedelta(days=20*365)
-date_range = st.date_input("Date range", [twenty_years_ago, today])
-
-df = get_stock_data(stocks, date_range[0], date_range[1])
 
 
 st.header("2. Normalize the data")
@@ -98,17 +82,29 @@ if normalize_data:
     df["Close"] = (df["Close"] / df.groupby("Symbol")["Close"].transform('first')) * 100  # Normalize to percentage change from first date
 """, language='python')
 
-normalize_data = st.checkbox('Normalize data', value=False)
-if normalize_data:
-    df["Close"] = (df["Close"] / df.groupby("Symbol")["Close"].transform('first')) * 100  # Normalize to percentage change from first date
-
 st.header("3.: Add Ticker Input")
 st.code("""
 new_stock = st.text_input('Enter a new stock ticker')
 stocks[new_stock] = new_stock
 """, language='python')
 st.markdown("We've added an input for users to enter new stock tickers. ")
-new_stock = st.text_input('Enter a new stock ticker')
+
+# The inputs of the three steps above are submitted together with one Apply, so typing a ticker or picking
+# the dates of the range doesn't rerun the page at every step
+with st.form("controls"):
+    today = datetime.today().date()
+    twenty_years_ago = today - timedelta(days=20*365)
+    date_range = st.date_input("Date range", [twenty_years_ago, today])
+    granularity = st.selectbox("Granularity", list(GRANULARITIES), index=2)
+    normalize_data = st.checkbox('Normalize data', value=False)
+    new_stock = st.text_input('Enter a new stock ticker')
+    st.form_submit_button("Apply")
+
+# A range with only its first date picked comes back as a single date, it is shown up to today
+if len(date_range) < 2:
+    st.warning("Only the start date of the range was picked, showing the prices up to today.")
+    date_range = (date_range[0], today)
+
 if new_stock:
     try:
         stocks[new_stock] = new_stock
@@ -116,17 +112,13 @@ if new_stock:
         st.warning(f"Failed to fetch data for {new_stock}. Please make sure it's a valid ticker symbol.")
         st.write("Error details:", str(e))
 
-df = pd.DataFrame()
-for stock in stocks.values():
-    df = pd.concat([df, fetch_data(stock, date_range[0], date_range[1])])
-
 clist = list(stocks.keys())
 stocks_selected = st.multiselect("Select stock", clist)
 st.header("You selected: {}".format(", ".join(stocks_selected)))
 
-
-dfs = {stock: df[df["Symbol"] == stocks[stock]] for stock in stocks_selected}
-draw_plot(dfs)
+# Only the selected stocks are loaded, stocks selected before stay warm in the shared cache
+# Normalized lines show the percentage change from the first date of each stock
+draw_plot({stock: stocks[stock] for stock in stocks_selected}, date_range[0], date_range[1], granularity, normalize_data)
 
 st.header("Full Code")
 st.code("""
@@ -1,8 +1,11 @@
 import pandas as pd
 import streamlit as st
 import plotly.graph_objects as go
-import yfinance as yf
 from datetime import datetime, timedelta
+from market_data import (GRANULARITIES, ROLLING_METRICS, ROLLING_WINDOWS, cache_usage, fetch_stats, performance_table,
+                         finish_rerun, normalize_ticker, prefetch_status, price_chart, price_figure, price_matrix,
+                         process_percentiles, rolling_matrix, search_symbols, stage, start_prefetch, start_rerun,
+                         universe_symbols, validate_ticker)
 
 st.set_page_config(layout="wide")
 hide_st_style = """
@@ -14,6 +17,13 @@ hide_st_style = """
             """
 st.markdown(hide_st_style, unsafe_allow_html=True)
 
+# Keeps the default stocks loaded and refreshed after the market close (only the first call starts it)
+start_prefetch()
+
+# Opt-in instrumentation of this run: stage timings, cache lookups and bytes sent to the browser
+instrumented = st.sidebar.toggle("Instrumentation")
+start_rerun("Final result", instrumented)
+
 st.header("Final assignement")
 if st.button('Celebrate!'):
     st.balloons()
@@ -48,62 +58,168 @@ stocks = {
     "S&P 500": "^GSPC"
 }
 
-@st.cache_data
-def fetch_data(stock, start_date, end_date):
-    stock_data = yf.download(stock, start=start_date, end=end_date)["Adj Close"]  # Adjust the date range as needed
-    stock_data = stock_data.resample('Q').last() # Resample data to get the last price of each month
-    stock_data = stock_data.reset_index()
-    stock_data["Symbol"] = stock
-    return stock_data
-
-# Add a slider for the time period selection
-today = datetime.today().date()
-twenty_years_ago = today - timedelta(days=20*365)
-date_range = st.date_input("Date range", [twenty_years_ago, today])
-
-# Add the ability to write a stock ticker
-new_stock = st.text_input('Enter a new stock ticker')
-
-# Test if new_stock is valid
-try:
-    # Try to download data for the new_stock from yfinance.
-    # If new_stock is not a valid ticker, an error will occur here.
-    test_data = yf.download(new_stock, start=date_range[0], end=date_range[1])
-
-    # If the downloaded data is empty, it indicates that new_stock may not be a valid ticker
-    # or there's no available data for the given date range. Show a warning message in this case.
-    if test_data.empty:
-        st.warning(f"Failed to fetch data for {new_stock}. Please make sure it's a valid ticker symbol.")
-    else:
-        # If the downloaded data is not empty, it means new_stock is a valid ticker.
-        # Add new_stock to the stocks dictionary.
-        stocks[new_stock] = new_stock
-except:
-    # If an error occurred while downloading data for new_stock, silently ignore it.
-    # Note: It's generally a good idea to at least log the error message or show it to the user,
-    # rather than ignoring it entirely.
-    pass
-
-# Fetch stock prices using the yfinance library
-df = pd.DataFrame()
-for stock in stocks.values():
-    df = pd.concat([df, fetch_data(stock, date_range[0], date_range[1])])
+# All inputs that change what is loaded are submitted together with one Apply, so picking the dates of the
+# range doesn't rerun the page at every step
+with st.form("controls"):
+    # Add a slider for the time period selection
+    today = datetime.today().date()
+    twenty_years_ago = today - timedelta(days=20*365)
+    date_range = st.date_input("Date range", [twenty_years_ago, today])
+    granularity = st.selectbox("Granularity", list(GRANULARITIES), index=3)
+
+    # Add checkbox to toggle normalization
+    normalize_data = st.checkbox('Normalize data', value=False)
+    st.form_submit_button("Apply")
+
+# A range with only its first date picked comes back as a single date, it is shown up to today
+if len(date_range) < 2:
+    st.warning("Only the start date of the range was picked, showing the prices up to today.")
+    date_range = (date_range[0], today)
+
+# Stocks added with the search below stay available for the rest of the session
+stocks.update(st.session_state.setdefault("added_stocks", {}))
+# Every stock of the prebuilt universe (if one was built) can be selected right away, its prices are already on disk
+stocks.update({symbol: symbol for symbol in universe_symbols() if symbol not in stocks.values()})
+
+
+# Add the ability to search a stock ticker. Typing a query reruns only this part of the page.
+@st.fragment
+def add_stock_section(start_date, end_date):
+    query = st.text_input('Enter a new stock ticker or company name')
+    if not query:
+        return
+    # Listed symbols are found in the local symbol list, so they are valid without asking the API
+    matches = dict(search_symbols(query))
+    # Unless it is listed, the ticker as typed is offered after the listings that look like it
+    typed = normalize_ticker(query)
+    if typed not in matches and " " not in typed:
+        matches[typed] = None
+    if not matches:
+        st.warning(f"No listing matches {query}.")
+        return
+    new_stock = st.selectbox("Matching listings", list(matches),
+                             format_func=lambda symbol: "{} - {}".format(symbol, matches[symbol]) if matches[symbol]
+                             else "{} (not in the symbol list)".format(symbol))
+    if matches[new_stock] is None:
+        # Test if a ticker missing from the symbol list is valid. The check downloads its data once and keeps it
+        # in the cache, so plotting it later doesn't download it again. Invalid tickers are remembered for a while.
+        try:
+            if not validate_ticker(new_stock, start_date, end_date):
+                # No data means new_stock may not be a valid ticker or there's no available data
+                # for the given date range. Show a warning message in this case.
+                st.warning(f"Failed to fetch data for {new_stock}. Please make sure it's a valid ticker symbol.")
+                return
+        except Exception as e:
+            # If an error occurred while downloading data for new_stock, show it to the user
+            st.warning(f"Failed to fetch data for {new_stock}. Please make sure it's a valid ticker symbol.")
+            st.write("Error details:", str(e))
+            return
+    if st.button("Add {}".format(new_stock)):
+        # Add new_stock to the stocks dictionary and rerun the page to offer it in the selection
+        st.session_state["added_stocks"][new_stock] = new_stock
+        st.rerun()
+
+
+add_stock_section(date_range[0], date_range[1])
 
 clist = list(stocks.keys())
 stocks_selected = st.multiselect("Select stock", clist)
 
-# Add checkbox to toggle normalization
-normalize_data = st.checkbox('Normalize data', value=False)
+# Fetch stock prices using the yfinance library, only for the selected stocks and all uncached ones in a single request.
+# The result is one Date x Stock frame of adjusted closes, resampled in memory from the cached daily history
+# Columns are picked by symbol, so two names of the same stock each get theirs
+df = price_matrix([stocks[stock] for stock in stocks_selected], date_range[0], date_range[1], granularity, "Adj Close")
+df = df[[stocks[stock] for stock in stocks_selected]].set_axis(stocks_selected, axis=1)
 
-if normalize_data:
-    df["Adj Close"] = (df["Adj Close"] / df.groupby("Symbol")["Adj Close"].transform('first')) * 100  # Normalize to percentage change from first date
+# Stocks whose download failed or is still running are shown without data instead of blocking the page
+stocks_missing = [stock for stock in df.columns if df[stock].isna().all()]
+if stocks_missing:
+    st.warning("No data available for {} right now, please try again in a moment.".format(", ".join(stocks_missing)))
 
 st.header("You selected: {}".format(", ".join(stocks_selected)))
 
-dfs = {stock: df[df["Symbol"] == stocks[stock]] for stock in stocks_selected}
-
-fig = go.Figure()
-for stock, df in dfs.items():
-    fig = fig.add_trace(go.Scatter(x=df["Date"], y=df["Adj Close"], name=stock))
 
-st.plotly_chart(fig)
+# Moving the rebase date or the zoom reruns only this part of the page
+@st.fragment
+def price_section(stocks, start_date, end_date, granularity, normalize_data):
+    # The sliders need a range to slide over, and a range ending where it starts holds no prices
+    if start_date >= end_date:
+        st.warning("Pick an end date after the start date to see the chart.")
+        return
+
+    # Normalized lines show the percentage change from the chosen date, the first date of the range by default
+    rebase_date = None
+    if normalize_data:
+        rebase_date = st.slider("Rebase to 100 on", min_value=start_date, max_value=end_date, value=start_date,
+                                format="YYYY-MM-DD")
+
+    # Zoom into a part of the date range, the chart then shows it in more detail
+    zoom = st.slider("Zoom", min_value=start_date, max_value=end_date, value=(start_date, end_date), format="YYYY-MM-DD")
+
+    # The figure is memoized on the selection, dates, granularity, normalization and zoom, and only lines of newly
+    # selected stocks are built. Long daily histories are downsampled to about one point per pixel and drawn with WebGL.
+    fig = price_chart(stocks, start_date, end_date, granularity, "Adj Close", normalize_data, zoom, rebase_date)
+
+    with stage("plotly_chart", payload=fig):
+        st.plotly_chart(fig)
+
+
+price_section({stock: stocks[stock] for stock in stocks_selected}, date_range[0], date_range[1], granularity,
+              normalize_data)
+
+# Performance of the selected stocks from daily adjusted closes, compared to the S&P 500 index
+st.subheader("Performance compared to the S&P 500")
+performance = performance_table([stocks[stock] for stock in stocks_selected], date_range[0], date_range[1])
+performance = performance.loc[[stocks[stock] for stock in stocks_selected]].set_axis(stocks_selected, axis=0)
+percent = st.column_config.NumberColumn(format="percent")
+ratio = st.column_config.NumberColumn(format="%.2f")
+with stage("dataframe", rows=len(performance), payload=performance):
+    st.dataframe(performance, column_config={"Total return": percent, "CAGR": percent, "Volatility": percent,
+                                             "Max drawdown": percent, "Sharpe": ratio, "Beta": ratio, "Correlation": ratio})
+
+
+# Rolling risk of the selected stocks against the S&P 500, kept up to date incrementally as new days arrive.
+# Picking another metric or window reruns only this part of the page
+@st.fragment
+def rolling_section(stocks, start_date, end_date):
+    st.subheader("Rolling risk compared to the S&P 500")
+    metric_column, window_column = st.columns(2)
+    metric = metric_column.selectbox("Metric", ROLLING_METRICS)
+    window = window_column.selectbox("Window (trading days)", ROLLING_WINDOWS, index=2)
+    rolling = rolling_matrix(list(stocks.values()), start_date, end_date, metric, window)
+    rolling_fig = price_figure(rolling[list(stocks.values())].set_axis(list(stocks), axis=1))
+    with stage("plotly_chart", payload=rolling_fig):
+        st.plotly_chart(rolling_fig, key="rolling")
+
+
+rolling_section({stock: stocks[stock] for stock in stocks_selected}, date_range[0], date_range[1])
+
+# The default stocks are refreshed in the background after every market close
+status = prefetch_status()
+last_updated = status["last_updated"].strftime("%Y-%m-%d %H:%M %Z") if status["last_updated"] else "not yet"
+next_refresh = status["next_refresh"].strftime("%Y-%m-%d %H:%M %Z") if status["next_refresh"] else "after the first load"
+st.sidebar.caption("Default stocks: {}, last updated {}, next refresh {}".format(status["state"], last_updated, next_refresh))
+if status["missing"]:
+    st.sidebar.caption("No data for {} in the last refresh".format(", ".join(status["missing"])))
+
+with st.expander("Download statistics"):
+    st.dataframe(fetch_stats())
+
+# Memory held by the price caches of this server process, shared by all sessions
+with st.expander("Cache memory"):
+    usage = cache_usage()
+    st.write("{:.1f} of {:.0f} MiB used".format(usage["bytes"].sum() / 2 ** 20, usage.attrs["budget"] / 2 ** 20))
+    st.dataframe(usage)
+
+rerun = finish_rerun()
+if instrumented:
+    # Nested stages are part of the stage above them with a lower depth
+    stages, cache = rerun.report()
+    st.sidebar.subheader("Instrumentation")
+    st.sidebar.write("This run took {:.3f}s, {:,} bytes were sent for charts and tables".format(
+        rerun.seconds, int(stages["bytes"].sum())))
+    st.sidebar.dataframe(stages, hide_index=True)
+    st.sidebar.caption("Cache lookups")
+    st.sidebar.dataframe(cache, hide_index=True)
+    st.sidebar.caption("Seconds per stage over the recent runs of this server process")
+    st.sidebar.dataframe(process_percentiles())